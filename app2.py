@@ -1,15 +1,35 @@
 from flask import Flask, Response
 from flask_sqlalchemy import SQLAlchemy
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
 import io
-import pandas as pd
-from flask import flash, redirect, url_for, request, session
-from datetime import datetime
+import csv
+import gzip
+import hashlib
+import json
+from flask import flash, redirect, url_for, request, session, g, has_app_context, has_request_context, stream_with_context, send_file
+from flask.sessions import SessionInterface, SessionMixin
+from flask_sqlalchemy.session import Session as FlaskSession
+from werkzeug.datastructures import CallbackDict
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+from datetime import date, datetime, timedelta
+from functools import wraps
+from urllib.parse import urlencode
 import os
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+import random
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ContextDecorator
+from xml.sax.saxutils import escape as xml_escape
 
 from new1.app import html_footer
 
@@ -18,41 +38,911 @@ app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///students.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+# 连接池配置
+app.config['DB_POOL_SIZE'] = 10
+app.config['DB_MAX_OVERFLOW'] = 20
+app.config['DB_POOL_TIMEOUT'] = 30
+app.config['DB_POOL_RECYCLE'] = 3600
+app.config['DB_READ_POOL_SIZE'] = 20
+
+# SQLite 性能配置档，连接建立时通过 PRAGMA 生效
+SQLITE_PROFILES = {
+    'default': {
+        'busy_timeout': 5000,
+    },
+    'performance': {
+        'journal_mode': 'WAL',          # 读写并发，读不再被导入事务阻塞
+        'synchronous': 'NORMAL',        # WAL 模式下安全且更快
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,       # 负数单位为KB，即64MB
+        'busy_timeout': 5000,           # 遇到锁时等待，而不是直接报 database is locked
+        'temp_store': 'MEMORY',
+    },
+}
+app.config['SQLITE_PROFILE'] = 'performance'
+
+# 只读副本允许落后主库的最长时间（秒），超过后只读路由回退到主库
+app.config['REPLICA_MAX_STALENESS'] = 60
+
+# 登录与会话
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'  # 例如 pbkdf2:sha256:600000，需写全参数
+app.config['LOGIN_MAX_ATTEMPTS'] = 5        # 时间窗口内同一用户名允许的失败次数
+app.config['LOGIN_MAX_ATTEMPTS_PER_IP'] = 100   # 同一IP允许的失败次数；学校网络中很多教师共用一个出口地址
+app.config['LOGIN_WINDOW'] = 300            # 秒
+app.config['LOGIN_LIMITER_SIZE'] = 10000    # 限流器最多跟踪的用户名/IP数量
+app.config['SESSION_BACKEND'] = 'server'    # server：会话存数据库，Cookie 只保存会话ID；cookie：Flask 默认签名 Cookie
+app.config['PROXY_FIX_X_FOR'] = 0           # 前面的反向代理层数；大于0时从 X-Forwarded-For 取客户端地址
+app.config['USER_CACHE_TTL'] = 60           # 用户信息在进程内缓存的秒数（见“权限控制”）
+
+# 运行指标、查询次数预算和单个请求的性能分析
+app.config['METRICS_ENABLED'] = True
+app.config['METRICS_TOKEN'] = None          # 设置后 /metrics 需要 Authorization: Bearer <token>
+app.config['METRICS_DEBUG_FOOTER'] = False  # 在页面底部显示本次请求的统计
+app.config['QUERY_BUDGET_WARN'] = False     # 非开发模式下也按 QUERY_BUDGETS 检查并记录警告
+app.config['PROFILE_DIR'] = os.path.join(app.instance_path, 'profiles')
+app.config['PROFILE_MAX_FILES'] = 50
+
+# 导入、导出和备份
+app.config['IMPORT_WORKERS'] = min(4, os.cpu_count() or 1)    # zip 导入的进程数
+app.config['IMPORT_ERROR_LIMIT'] = 10000
+app.config['IMPORT_REPORT_MAX_AGE'] = 7 * 24 * 3600
+app.config['EXPORT_DIR'] = os.path.join(app.instance_path, 'exports')
+app.config['EXPORT_MAX_BYTES'] = 500 * 1024 * 1024
+app.config['EXPORT_MAX_AGE'] = 7 * 24 * 3600
+app.config['EXPORT_WORKERS'] = 2
+app.config['BACKUP_DIR'] = os.path.join(app.instance_path, 'backups')
+app.config['BACKUP_RETENTION'] = 10
+app.config['BACKUP_PAGES_PER_STEP'] = 1024
+app.config['BACKUP_FULL_EVERY'] = 7         # 每隔多少个增量做一次全量备份
+
+# 配置文件（STUDENT_SYSTEM_SETTINGS 指向的 Python 文件）和环境变量覆盖上面的默认值
+app.config.from_envvar('STUDENT_SYSTEM_SETTINGS', silent=True)
+
+
+def env_flag(value):
+    return value.lower() not in ('0', 'false', 'no', 'off')
+
+
+ENV_SETTINGS = {
+    'SECRET_KEY': ('SECRET_KEY', str),
+    'DATABASE_URL': ('SQLALCHEMY_DATABASE_URI', str),
+    'DATABASE_READ_URL': ('DATABASE_READ_URL', str),
+    'DB_POOL_SIZE': ('DB_POOL_SIZE', int),
+    'DB_MAX_OVERFLOW': ('DB_MAX_OVERFLOW', int),
+    'DB_POOL_TIMEOUT': ('DB_POOL_TIMEOUT', int),
+    'DB_POOL_RECYCLE': ('DB_POOL_RECYCLE', int),
+    'DB_READ_POOL_SIZE': ('DB_READ_POOL_SIZE', int),
+    'SQLITE_PROFILE': ('SQLITE_PROFILE', str),
+    'REPLICA_MAX_STALENESS': ('REPLICA_MAX_STALENESS', float),
+    'PASSWORD_HASH_METHOD': ('PASSWORD_HASH_METHOD', str),
+    'LOGIN_MAX_ATTEMPTS': ('LOGIN_MAX_ATTEMPTS', int),
+    'LOGIN_MAX_ATTEMPTS_PER_IP': ('LOGIN_MAX_ATTEMPTS_PER_IP', int),
+    'LOGIN_WINDOW': ('LOGIN_WINDOW', int),
+    'SESSION_BACKEND': ('SESSION_BACKEND', str),
+    'PROXY_FIX_X_FOR': ('PROXY_FIX_X_FOR', int),
+    'METRICS_ENABLED': ('METRICS_ENABLED', env_flag),
+    'METRICS_TOKEN': ('METRICS_TOKEN', str),
+    'METRICS_DEBUG_FOOTER': ('METRICS_DEBUG_FOOTER', env_flag),
+    'QUERY_BUDGET_WARN': ('QUERY_BUDGET_WARN', env_flag),
+    'PROFILE_DIR': ('PROFILE_DIR', str),
+    'IMPORT_WORKERS': ('IMPORT_WORKERS', int),
+    'EXPORT_DIR': ('EXPORT_DIR', str),
+    'EXPORT_MAX_BYTES': ('EXPORT_MAX_BYTES', int),
+    'EXPORT_MAX_AGE': ('EXPORT_MAX_AGE', int),
+    'EXPORT_WORKERS': ('EXPORT_WORKERS', int),
+    'BACKUP_DIR': ('BACKUP_DIR', str),
+    'BACKUP_RETENTION': ('BACKUP_RETENTION', int),
+    'BACKUP_FULL_EVERY': ('BACKUP_FULL_EVERY', int),
+}
+for env_name, (config_key, cast) in ENV_SETTINGS.items():
+    if os.environ.get(env_name):
+        app.config[config_key] = cast(os.environ[env_name])
+
+# 部署在 nginx 等反向代理之后时，request.remote_addr 取代理转发的客户端地址（只信任指定层数的代理）
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+
+def normalize_database_url(url):
+    # Heroku 等平台给出的 postgres:// 前缀 SQLAlchemy 不再识别
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_memory_sqlite(url):
+    return url.startswith('sqlite') and (url in ('sqlite://', 'sqlite:///') or ':memory:' in url)
+
+
+def engine_options(url, pool_size):
+    # 内存 SQLite 使用 StaticPool，不接受连接池参数
+    if is_memory_sqlite(url):
+        return {'url': url}
+    return {
+        'url': url,
+        'pool_size': pool_size,
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['DATABASE_READ_URL'] = normalize_database_url(
+    app.config.get('DATABASE_READ_URL') or app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'], app.config['DB_POOL_SIZE'])
+del app.config['SQLALCHEMY_ENGINE_OPTIONS']['url']
+
+# 只读连接池：统计、排序、导出、备份等读多写少的路由使用独立的连接池
+# 内存数据库无法被第二个连接池共享，此时只读路由直接使用主连接池
+app.config['SQLALCHEMY_BINDS'] = {}
+if not is_memory_sqlite(app.config['DATABASE_READ_URL']):
+    app.config['SQLALCHEMY_BINDS']['read'] = engine_options(
+        app.config['DATABASE_READ_URL'], app.config['DB_READ_POOL_SIZE'])
+
+
+class RoutingSession(FlaskSession):
+    # 标记为只读的请求（以及由它提交的后台任务），查询走只读连接池；
+    # 写入（flush 和 INSERT/UPDATE/DELETE 语句）始终走主连接池
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not isinstance(clause, UpdateBase)
+                and has_app_context()
+                and g.get('read_only') and 'read' in self._db.engines):
+            return self._db.engines['read']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+
+def on_connect(dbapi_connection, read_only=False):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        # PostgreSQL 等后端：只读连接池在会话级别设置只读事务
+        if read_only:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+            cursor.close()
+            dbapi_connection.commit()
+        return
+    pragmas = SQLITE_PROFILES.get(app.config['SQLITE_PROFILE'], SQLITE_PROFILES['default'])
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        # 只读连接不修改日志模式：快照副本使用回滚日志模式，同步时整个文件被替换（见 sync_sqlite_replica）
+        if not (read_only and name == 'journal_mode'):
+            cursor.execute(f"PRAGMA {name}={value}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def configure_engines():
+    for key, engine in db.engines.items():
+        read_only = key == 'read'
+        event.listen(engine, 'connect',
+                     lambda conn, record, read_only=read_only: on_connect(conn, read_only))
+        event.listen(engine, 'before_cursor_execute', before_query)
+        event.listen(engine, 'after_cursor_execute', after_query)
+
+
+# 运行指标
+# 请求钩子记录每个路由的耗时直方图和响应字节数，SQL 事件记录查询次数、耗时和行数
+# （ORM 加载的对象数 + 写操作影响的行数），通过 /metrics 以 Prometheus 文本格式输出。
+# 指标保存在进程内，多个 worker 时每个 worker 各自统计。
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BACKGROUND_ROUTE = '(background)'
+metrics_lock = threading.Lock()
+route_metrics = {}
+sql_metrics = {}
+
+
+def current_route():
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return BACKGROUND_ROUTE if not has_request_context() else '(unmatched)'
+
+
+def sql_stats():
+    # 请求中的查询累计到 g，请求结束时一次性合并；后台线程直接合并到全局
+    if has_request_context():
+        if 'sql_stats' not in g:
+            g.sql_stats = [0, 0, 0.0]
+        return g.sql_stats
+    return None
+
+
+def merge_sql_stats(route, queries, rows, seconds):
+    with metrics_lock:
+        totals = sql_metrics.setdefault(route, [0, 0, 0.0])
+        totals[0] += queries
+        totals[1] += rows
+        totals[2] += seconds
+
+
+def before_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = time.perf_counter()
+
+
+def after_query(conn, cursor, statement, parameters, context, executemany):
+    for budget in getattr(budget_local, 'active', ()):
+        budget.count += 1
+    if not app.config['METRICS_ENABLED']:
+        return
+    elapsed = time.perf_counter() - conn.info['query_start']
+    rows = cursor.rowcount if context.isinsert or context.isupdate or context.isdelete else 0
+    rows = max(rows, 0)
+    stats = sql_stats()
+    if stats is None:
+        merge_sql_stats(BACKGROUND_ROUTE, 1, rows, elapsed)
+        return
+    stats[0] += 1
+    stats[1] += rows
+    stats[2] += elapsed
+    if 'profile_sql' in g:
+        g.profile_sql.append({'statement': statement, 'parameters': repr(parameters)[:500],
+                              'executemany': executemany, 'rows': rows, 'ms': round(elapsed * 1000, 3)})
+
+
+@event.listens_for(db.Model, 'load', propagate=True)
+def count_loaded_row(target, context):
+    if not app.config['METRICS_ENABLED']:
+        return
+    stats = sql_stats()
+    if stats is None:
+        merge_sql_stats(BACKGROUND_ROUTE, 0, 1, 0.0)
+    else:
+        stats[1] += 1
+
+
+class CountingIterable:
+    # 流式响应（Parquet/xlsx 导出）在发送完毕时才知道总字节数
+    def __init__(self, iterable, route):
+        self.iterable = iterable
+        self.route = route
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+        with metrics_lock:
+            route_metrics[self.route]['bytes'] += self.size
+
+
+class ClosingIterable:
+    # 流式响应（xlsx、Parquet/Arrow 导出等）的生成过程发生在视图返回之后，发送完毕（或连接关闭）时调用 finish
+    def __init__(self, iterable, finish):
+        self.iterable = iterable
+        self.finish = finish
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.finish()
+
+
+@app.before_request
+def start_request_metrics():
+    if app.config['METRICS_ENABLED']:
+        g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    route = current_route()
+    queries, rows, sql_seconds = g.get('sql_stats', (0, 0, 0.0))
+    if app.config['METRICS_DEBUG_FOOTER'] and response.mimetype == 'text/html' and not response.is_streamed:
+        footer = (f'<div class="container text-muted small">{route} · {elapsed * 1000:.1f} ms · '
+                  f'{queries} 次查询（{sql_seconds * 1000:.1f} ms）· {rows} 行</div></body>')
+        response.set_data(response.get_data().replace(b'</body>', footer.encode(), 1))
+    with metrics_lock:
+        m = route_metrics.get(route)
+        if m is None:
+            m = route_metrics[route] = {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0,
+                                        'status': {}, 'bytes': 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                m['buckets'][i] += 1
+                break
+        m['count'] += 1
+        m['sum'] += elapsed
+        status = f'{response.status_code // 100}xx'
+        m['status'][status] = m['status'].get(status, 0) + 1
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = CountingIterable(response.response, route)
+        else:
+            m['bytes'] += response.content_length or 0
+    if queries or rows:
+        merge_sql_stats(route, queries, rows, sql_seconds)
+    return response
+
+
+def render_metrics():
+    lines = [
+        '# HELP student_http_request_duration_seconds 请求耗时',
+        '# TYPE student_http_request_duration_seconds histogram',
+    ]
+    with metrics_lock:
+        routes = {route: {'buckets': list(m['buckets']), 'count': m['count'], 'sum': m['sum'],
+                          'status': dict(m['status']), 'bytes': m['bytes']}
+                  for route, m in route_metrics.items()}
+        sql = {route: list(totals) for route, totals in sql_metrics.items()}
+    for route, m in sorted(routes.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, m['buckets']):
+            cumulative += count
+            lines.append(f'student_http_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+        lines.append(f'student_http_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {m["count"]}')
+        lines.append(f'student_http_request_duration_seconds_sum{{route="{route}"}} {m["sum"]:.6f}')
+        lines.append(f'student_http_request_duration_seconds_count{{route="{route}"}} {m["count"]}')
+    lines += ['# HELP student_http_requests_total 请求数（按状态码类别）',
+              '# TYPE student_http_requests_total counter']
+    for route, m in sorted(routes.items()):
+        for status, count in sorted(m['status'].items()):
+            lines.append(f'student_http_requests_total{{route="{route}",status="{status}"}} {count}')
+    lines += ['# HELP student_http_response_bytes_total 响应字节数',
+              '# TYPE student_http_response_bytes_total counter']
+    lines += [f'student_http_response_bytes_total{{route="{route}"}} {m["bytes"]}'
+              for route, m in sorted(routes.items())]
+    for index, (name, help_text) in enumerate([
+            ('student_db_queries_total', 'SQL 查询次数'),
+            ('student_db_rows_total', 'ORM 加载的对象数和写操作影响的行数'),
+            ('student_db_query_duration_seconds_total', 'SQL 执行耗时')]):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for route, totals in sorted(sql.items()):
+            value = f'{totals[index]:.6f}' if index == 2 else totals[index]
+            lines.append(f'{name}{{route="{route}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# 查询次数预算
+# 防止逐行查询（N+1）之类的问题悄悄回到代码里：query_budget 统计当前线程执行的 SQL 条数，
+# 超出上限时抛出 QueryBudgetExceeded（strict=False 时只记录警告）。可以用作上下文管理器或装饰器：
+#
+#   with query_budget(3, 'import_students'):
+#       ...
+#
+# 开发模式（app.debug 或 QUERY_BUDGET_WARN=1）下每个请求都按 QUERY_BUDGETS 检查，
+# 超出时记录警告，并在响应头 X-Query-Count 中给出本次请求的查询次数。
+# 需要登录的路由预留了一次加载用户的查询（用户缓存过期时）；流式导出在响应发送过程中执行的查询也计入，发送完毕时检查。
+# 预算与数据量无关；bench/query_budgets.py 在不同数据量下逐个路由检查。
+QUERY_BUDGETS = {
+    '/login': 2,
+    '/logout': 0,
+    '/': 6,
+    '/add': 6,
+    '/list': 3,
+    '/list/<sort_by>': 3,
+    '/edit/<sno>': 6,
+    '/delete/<sno>': 6,
+    '/audit': 2,
+    '/stats': 2,
+    '/stats/chart': 7,
+    '/stats/students': 2,
+    '/trend': 2,
+    '/import_export': 7,
+    '/export_csv': 2,
+    '/export_pdf': 2,
+    '/export_parquet': 2,
+    '/export_arrow': 2,
+    '/export_xlsx': 2,
+    '/export_ranking': 3,
+    '/sort_save': 4,
+    '/backup': 3,
+    '/import_report/<report_id>': 3,
+    '/import_report/<report_id>/download': 3,
+    '/metrics': 0,
+}
+budget_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget(ContextDecorator):
+    def __init__(self, max_queries, name=None, strict=True):
+        self.max_queries = max_queries
+        self.name = name
+        self.strict = strict
+        self.count = 0
+
+    def __enter__(self):
+        self.count = 0
+        if not hasattr(budget_local, 'active'):
+            budget_local.active = []
+        budget_local.active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self in budget_local.active:
+            budget_local.active.remove(self)
+        if exc_type is None and self.max_queries is not None and self.count > self.max_queries:
+            message = f'{self.name or "代码块"} 执行了 {self.count} 条 SQL，超出预算 {self.max_queries} 条'
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return False
+
+
+def query_budget(max_queries, name=None, strict=True):
+    return QueryBudget(max_queries, name, strict)
+
+
+def query_budget_enabled():
+    return app.debug or app.config['QUERY_BUDGET_WARN']
+
+
+@app.before_request
+def start_query_budget():
+    if query_budget_enabled() and request.url_rule is not None:
+        rule = request.url_rule.rule
+        g.query_budget = QueryBudget(QUERY_BUDGETS.get(rule), f'{request.method} {rule}', strict=False).__enter__()
+
+
+@app.after_request
+def check_query_budget(response):
+    budget = g.pop('query_budget', None)
+    if budget is None:
+        return response
+    if response.is_streamed and not response.direct_passthrough:
+        # 流式响应在发送过程中（同一线程）继续查询，发送完毕时才结束计数并检查预算；
+        # 此时响应头已经发出，不再给出 X-Query-Count
+        response.response = ClosingIterable(response.response, lambda: budget.__exit__(None, None, None))
+    else:
+        budget.__exit__(None, None, None)
+        response.headers['X-Query-Count'] = str(budget.count)
+    return response
+
+
+@app.teardown_request
+def discard_query_budget(exc):
+    # 视图抛出异常时 after_request 不会执行，这里把预算从当前线程移除
+    budget = g.pop('query_budget', None)
+    if budget is not None and budget in getattr(budget_local, 'active', ()):
+        budget_local.active.remove(budget)
+
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return 'Unauthorized', 401
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# 只读副本
+# DATABASE_READ_URL 与主库相同时只是独立的只读连接池；
+# 指向另一个 SQLite 文件时，该文件是主库的快照，超过延迟上限后在后台重新同步；
+# 指向 PostgreSQL 从库时，通过复制延迟判断是否可用
+replica_state = {'lock': threading.Lock(), 'syncing': False, 'lag_checked_at': 0.0, 'lag_ok': True}
+
+
+def replica_mode():
+    if 'read' not in db.engines:
+        return None
+    primary, replica = db.engines[None].url, db.engines['read'].url
+    if primary == replica:
+        return 'pool'
+    if primary.get_backend_name() == 'sqlite' and replica.get_backend_name() == 'sqlite':
+        return 'snapshot'
+    return 'replica'
+
+
+def replica_marker_path():
+    return db.engines['read'].url.database + '.synced'
+
+
+def sync_sqlite_replica():
+    # 使用 SQLite 在线备份 API 把主库复制到临时文件，分页复制不会长时间阻塞写入；
+    # 复制完成后原子替换副本文件，再丢弃只读连接池：正在查询的连接读完旧文件，新连接打开新文件。
+    # 副本改为回滚日志模式，替换时不会留下属于旧文件的 -wal/-shm。
+    # 标记文件的时间是同步开始的时间，副本中的数据不会比它更旧
+    started = time.time()
+    replica = db.engines['read'].url.database
+    tmp_path = replica + '.tmp'
+    src = sqlite3.connect(db.engines[None].url.database)
+    dst = sqlite3.connect(tmp_path)
+    try:
+        src.backup(dst, pages=1024, sleep=0.005)
+        dst.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        dst.close()
+        src.close()
+    try:
+        os.replace(tmp_path, replica)
+    except PermissionError:
+        # Windows 上打开着的文件不能替换，先关闭连接池中的连接
+        db.engines['read'].dispose()
+        os.replace(tmp_path, replica)
+    db.engines['read'].dispose()
+    with open(replica_marker_path(), 'w') as f:
+        f.write(datetime.fromtimestamp(started).isoformat())
+    os.utime(replica_marker_path(), (started, started))
+
+
+def sync_sqlite_replica_in_background():
+    with replica_state['lock']:
+        if replica_state['syncing']:
+            return
+        replica_state['syncing'] = True
+
+    def run():
+        try:
+            with app.app_context():
+                sync_sqlite_replica()
+        except Exception as e:
+            app.logger.warning(f'同步只读副本失败：{e}')
+        finally:
+            replica_state['syncing'] = False
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def replica_is_fresh():
+    mode = replica_mode()
+    max_staleness = app.config['REPLICA_MAX_STALENESS']
+    if mode is None:
+        return False
+    if mode == 'pool':
+        return True
+    if mode == 'snapshot':
+        marker = replica_marker_path()
+        if os.path.exists(marker) and time.time() - os.path.getmtime(marker) <= max_staleness:
+            return True
+        sync_sqlite_replica_in_background()
+        return False
+    # PostgreSQL 从库：最多每5秒检查一次复制延迟
+    now = time.time()
+    if now - replica_state['lag_checked_at'] > 5:
+        try:
+            with db.engines['read'].connect() as conn:
+                lag = conn.execute(db.text(
+                    "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+                )).scalar()
+            replica_state['lag_ok'] = float(lag) <= max_staleness
+        except Exception as e:
+            app.logger.warning(f'检查从库延迟失败：{e}')
+            replica_state['lag_ok'] = False
+        replica_state['lag_checked_at'] = now
+    return replica_state['lag_ok']
+
+
+def read_only_route(f):
+    # 只读路由装饰器：副本在延迟上限内时，本次请求的查询走只读副本，否则回退到主库
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.read_only = replica_is_fresh()
+        return f(*args, **kwargs)
+    return decorated
 
 
 # 数据库模型
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='teacher')
 
 class Student(db.Model):
+    # 按 (学校, 班级) 分区的查询都走以分区键开头的索引，只读取该分区的索引范围
+    __table_args__ = (
+        db.Index('ix_student_partition', 'school', 'class_name', 'updated_at'),
+        db.Index('ix_student_partition_sno', 'school', 'class_name', 'sno'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     sno = db.Column(db.String(20), unique=True, nullable=False)
     name = db.Column(db.String(80), nullable=False)
     score1 = db.Column(db.Float, nullable=False)
     score2 = db.Column(db.Float, nullable=False)
+    school = db.Column(db.String(80), nullable=False, default='')
+    class_name = db.Column(db.String(80), nullable=False, default='')
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, index=True)
+
+# 每个 (学校, 班级) 分区预先计算的统计：人数、成绩合计、及格人数和各等级人数。
+# version 是计算时该分区的“人数|最后修改时间”，与当前值不同时重新计算（见“学校/班级分区”）
+class PartitionStats(db.Model):
+    school = db.Column(db.String(80), primary_key=True)
+    class_name = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.String(64), nullable=False, default='')
+    student_count = db.Column(db.Integer, nullable=False, default=0)
+    score1_sum = db.Column(db.Float, nullable=False, default=0)
+    score2_sum = db.Column(db.Float, nullable=False, default=0)
+    pass_count = db.Column(db.Integer, nullable=False, default=0)
+    grade_counts = db.Column(db.Text, nullable=False, default='{}')    # JSON：{'score1': [各等级人数], 'score2': [...]}
+    refreshed_at = db.Column(db.DateTime)
+
+# 成绩历史：每次考试每门课一行，只追加（同一次考试重新录入时覆盖该次成绩），编辑学生不会丢失以前的成绩。
+# 主键 (学生ID, 课程, 考试日期) 即按学生的范围查询索引，没有额外的自增列；course 为 1 或 2，对应课程1和课程2
+class ScoreHistory(db.Model):
+    student_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    course = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    exam_date = db.Column(db.Date, primary_key=True, index=True)
+    score = db.Column(db.Float, nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+# 服务器端会话
+class UserSession(db.Model):
+    sid = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
 
 class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     credit = db.Column(db.Float, nullable=False)
 
-# 初始化数据库
+# 学生删除记录，供增量备份回放删除操作
+class StudentChangeLog(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sno = db.Column(db.String(20), nullable=False)
+    action = db.Column(db.String(20), nullable=False, default='delete')
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+@event.listens_for(Student, 'after_delete')
+def log_student_delete(mapper, connection, target):
+    connection.execute(StudentChangeLog.__table__.insert().values(
+        sno=target.sno, action='delete', changed_at=datetime.now()))
+
+# 写事务记录：修改了学生、成绩历史、删除记录、用户或课程的事务，在同一个事务中追加一行事务开始的时间。
+# 记录随事务一起提交，增量备份从还没有处理过的记录中最早的开始时间起导出（见“数据备份”），
+# 开始得早、提交得晚的事务不会因为修改时间早于上次备份而漏掉
+class WriteLog(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+
+# 导入错误报告：错误行保存在服务器端，会话中只保存报告ID
+class ImportReport(db.Model):
+    id = db.Column(db.String(16), primary_key=True)
+    username = db.Column(db.String(80), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    total_rows = db.Column(db.Integer, nullable=False)
+    error_count = db.Column(db.Integer, nullable=False)
+    error_types = db.Column(db.Text, nullable=False)    # JSON：{错误类型: 行数}
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+class ImportErrorRow(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    report_id = db.Column(db.String(16), nullable=False, index=True)
+    source = db.Column(db.String(255))     # zip 导入时错误所在的文件
+    line = db.Column(db.Integer, nullable=False)
+    error = db.Column(db.String(200), nullable=False)
+    sno = db.Column(db.String(200))
+    name = db.Column(db.String(200))
+    score1 = db.Column(db.String(200))
+    score2 = db.Column(db.String(200))
+
+# 审计日志：只追加，不修改不删除
+class AuditLog(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), nullable=False)
+    action = db.Column(db.String(20), nullable=False)
+    sno = db.Column(db.String(20), nullable=False, index=True)
+    old_value = db.Column(db.Text)
+    new_value = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+# 审计记录先放进会话的缓冲区，事务提交后整批交给单线程的写入队列，在请求之外序列化并批量 INSERT；
+# 回滚的事务不产生审计记录。请求中只多了构造元组的开销，5 万行导入也不会明显变慢。
+# 单个写入线程保证记录按提交顺序写入，进程退出前会等待队列写完。
+AUDIT_BATCH_SIZE = 1000
+AUDIT_FIELDS = ('name', 'score1', 'score2', 'school', 'class_name')    # 学校和班级：转班也会出现在审计中
+audit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audit')
+
+
+def audit_snapshot(values):
+    if values is None:
+        return None
+    return json.dumps({k: values[k] for k in AUDIT_FIELDS}, ensure_ascii=False)
+
+
+def audit(action, sno, old=None, new=None):
+    audit_many(action, [(sno, old, new)])
+
+
+def audit_many(action, changes):
+    # changes: [(学号, 旧值, 新值), ...]；用户和时间每批只取一次
+    username = session.get('username', 'system') if has_request_context() else 'system'
+    now = datetime.now()
+    db.session.info.setdefault('audit', []).extend(
+        (username, action, sno, old, new, now) for sno, old, new in changes)
+
+
+def write_audit_entries(entries):
+    rows = [{'username': username, 'action': action, 'sno': sno,
+             'old_value': audit_snapshot(old), 'new_value': audit_snapshot(new), 'created_at': created_at}
+            for username, action, sno, old, new, created_at in entries]
+    try:
+        with app.app_context(), db.engines[None].begin() as conn:
+            for i in range(0, len(rows), AUDIT_BATCH_SIZE):
+                conn.execute(AuditLog.__table__.insert(), rows[i:i + AUDIT_BATCH_SIZE])
+    except Exception:
+        app.logger.exception('审计日志写入失败（%d 条）', len(rows))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def flush_audit_queue(sess):
+    entries = sess.info.pop('audit', None)
+    if entries:
+        audit_executor.submit(write_audit_entries, entries)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def discard_audit_queue(sess):
+    sess.info.pop('audit', None)
+
+
+# 写事务记录的维护：会话开始事务时记下时间，flush 或执行 INSERT/UPDATE/DELETE 语句时标记是否修改了备份相关的表，
+# 提交前追加一行 WriteLog。直接使用 engine 的写入（初始化、恢复）不记录，增量备份仍按上次备份时间兜底
+WRITE_LOG_TABLES = {'student', 'score_history', 'student_change_log', 'user', 'course'}
+
+
+@event.listens_for(RoutingSession, 'after_begin')
+def remember_transaction_start(sess, transaction, connection):
+    sess.info.setdefault('transaction_started', datetime.now())
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def track_flush_writes(sess, flush_context, instances):
+    for obj in (*sess.new, *sess.dirty, *sess.deleted):
+        if obj.__table__.name in WRITE_LOG_TABLES:
+            sess.info['logged_write'] = True
+            return
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def track_statement_writes(state):
+    if (state.is_insert or state.is_update or state.is_delete) \
+            and getattr(state.statement.table, 'name', None) in WRITE_LOG_TABLES:
+        state.session.info['logged_write'] = True
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def append_write_log(sess):
+    sess.flush()
+    if sess.info.pop('logged_write', False):
+        sess.execute(WriteLog.__table__.insert().values(
+            started_at=sess.info.get('transaction_started') or datetime.now()))
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def reset_write_log_state(sess, transaction):
+    if transaction.parent is None:
+        sess.info.pop('transaction_started', None)
+        sess.info.pop('logged_write', None)
+
+# 成绩历史的写入：添加、修改成绩和导入时调用，与学生数据在同一个事务中提交
+HISTORY_COURSES = {1: 'score1', 2: 'score2'}
+HISTORY_LOOKUP_CHUNK = 10000
+
+
+def parse_exam_date(value):
+    # 表单中的考试日期（YYYY-MM-DD），为空时是今天；格式错误时抛出 ValueError
+    value = (value or '').strip()
+    return date.fromisoformat(value) if value else date.today()
+
+
+def student_ids(snos):
+    # 学号 -> 学生ID，每 HISTORY_LOOKUP_CHUNK 个学号一次查询
+    snos = list(snos)
+    ids = {}
+    for i in range(0, len(snos), HISTORY_LOOKUP_CHUNK):
+        ids.update(db.session.execute(db.select(Student.sno, Student.id)
+                                      .where(Student.sno.in_(snos[i:i + HISTORY_LOOKUP_CHUNK]))).all())
+    return ids
+
+
+def record_scores(entries, exam_date):
+    # entries: [(学生ID, 课程1成绩, 课程2成绩), ...]；同一学生同一天再次录入时覆盖当天的成绩
+    now = datetime.now()
+    rows = [{'student_id': student_id, 'course': course, 'exam_date': exam_date,
+             'score': float(scores[course - 1]), 'recorded_at': now}
+            for student_id, *scores in entries for course in HISTORY_COURSES]
+    # 每批 1000 名学生，与学生表的写入批次一致
+    batch = 1000 * len(HISTORY_COURSES)
+    for i in range(0, len(rows), batch):
+        upsert_rows(ScoreHistory, rows[i:i + batch], ['student_id', 'course', 'exam_date'], ['score', 'recorded_at'])
+
+
+def seed_score_history():
+    # 第一次创建成绩历史表时，把每个学生当前的成绩记为最后修改那天的一次考试
+    history_table = ScoreHistory.__table__
+    now = datetime.now()
+    with db.engine.begin() as conn:
+        for course, field in HISTORY_COURSES.items():
+            conn.execute(history_table.insert().from_select(
+                ['student_id', 'course', 'exam_date', 'score', 'recorded_at'],
+                db.select(Student.id, db.literal(course), db.func.date(Student.updated_at),
+                          getattr(Student, field), db.literal(now))))
+
+# 旧数据库缺少的列：create_all 不会修改已存在的表，启动时补齐
+SCHEMA_UPGRADES = [
+    ('student', 'updated_at', 'TIMESTAMP', [
+        'UPDATE student SET updated_at = created_at WHERE updated_at IS NULL',
+        'CREATE INDEX IF NOT EXISTS ix_student_updated_at ON student (updated_at)',
+    ]),
+    ('import_error_row', 'source', 'VARCHAR(255)', []),
+    ('student', 'school', "VARCHAR(80) NOT NULL DEFAULT ''", []),
+    ('student', 'class_name', "VARCHAR(80) NOT NULL DEFAULT ''", [
+        'CREATE INDEX IF NOT EXISTS ix_student_partition ON student (school, class_name, updated_at)',
+        'CREATE INDEX IF NOT EXISTS ix_student_partition_sno ON student (school, class_name, sno)',
+    ]),
+]
+
+def upgrade_schema():
+    inspector = db.inspect(db.engine)
+    for table, column, ddl, statements in SCHEMA_UPGRADES:
+        if column in {c['name'] for c in inspector.get_columns(table)}:
+            continue
+        with db.engine.begin() as conn:
+            conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+            for statement in statements:
+                conn.execute(db.text(statement))
+
+def upsert_rows(model, rows, index_elements, update_columns):
+    # 批量插入或更新，SQLite 和 PostgreSQL 都支持 ON CONFLICT ... DO UPDATE；
+    # update_columns 为空时已存在的行保持不变（ON CONFLICT DO NOTHING）
+    if not rows:
+        return
+    dialect = db.session.get_bind(model).dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f'不支持的数据库后端：{dialect}（批量写入需要 SQLite 或 PostgreSQL）')
+    stmt = insert(model.__table__)
+    if not update_columns:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={col: stmt.excluded[col] for col in update_columns}
+        )
+    db.session.execute(stmt, rows)
+
 with app.app_context():
+    configure_engines()
+
+# 初始化数据库
+# 不在导入模块时执行：由 flask init-db 命令、create_app() 或直接运行本文件时调用一次
+def init_db():
+    seed_history = not db.inspect(db.engine).has_table(ScoreHistory.__tablename__)
     db.create_all()
+    upgrade_schema()
+    if seed_history:
+        seed_score_history()
     # 创建默认管理员账户
     if not User.query.filter_by(username='admin').first():
         admin = User(
             username='admin',
-            password=generate_password_hash('admin123'),
+            password=hash_password('admin123'),
             role='admin'
         )
         db.session.add(admin)
         db.session.commit()
+    if replica_mode() == 'snapshot':
+        sync_sqlite_replica()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    init_db()
+    print('数据库初始化完成')
 
 def render_css():
     return """
@@ -116,6 +1006,13 @@ def html_header(title="学生成绩管理系统"):
         <li class="nav-item"><a class="nav-link" href="/login"><i class="fas fa-sign-in-alt"></i> 登录</a></li>
     """
 
+    # 数据备份和审计日志仅管理员可见；角色与 role_required 一样取自 current_user()，而不是登录时写进会话的值
+    user = current_user()
+    backup_link = """
+        <a class="dropdown-item" href="/backup"><i class="fas fa-database"></i> 数据备份</a>
+        <a class="dropdown-item" href="/audit"><i class="fas fa-history"></i> 审计日志</a>
+    """ if user and user['role'] == 'admin' else ""
+
     return f"""
     <!DOCTYPE html>
     <html>
@@ -151,7 +1048,7 @@ def html_header(title="学生成绩管理系统"):
                             <div class="dropdown-menu">
                                 <a class="dropdown-item" href="/sort_save"><i class="fas fa-sort-amount-down"></i> 排序保存</a>
                                 <a class="dropdown-item" href="/import_export"><i class="fas fa-file-import"></i> 导入导出</a>
-                                <a class="dropdown-item" href="/backup"><i class="fas fa-database"></i> 数据备份</a>
+                                {backup_link}
                             </div>
                         </li>
                     </ul>
@@ -165,20 +1062,310 @@ def html_header(title="学生成绩管理系统"):
             <h2 class="mb-4">{title}</h2>
     """
 
+# 权限控制
+# 每个请求只解析一次当前用户（缓存在 g 中），用户信息在进程内缓存 USER_CACHE_TTL 秒；
+# 角色取自数据库而不是会话，管理员拥有教师的全部权限
+ROLE_LEVELS = {'teacher': 1, 'admin': 2}
+USER_CACHE_SIZE = 10000
+user_cache = {}
+
+
+def load_user(username):
+    now = time.time()
+    cached = user_cache.get(username)
+    if cached and cached[0] > now:
+        return cached[1]
+    row = db.session.execute(
+        db.select(User.id, User.username, User.role).where(User.username == username)).first()
+    user = dict(row._mapping) if row else None
+    if len(user_cache) >= USER_CACHE_SIZE:
+        user_cache.clear()
+    user_cache[username] = (now + app.config['USER_CACHE_TTL'], user)
+    return user
+
+
+def current_user():
+    if 'current_user' not in g:
+        g.current_user = load_user(session.get('username')) if session.get('logged_in') else None
+    return g.current_user
+
+
+def role_required(role):
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            user = current_user()
+            if user is None:
+                return redirect(url_for('login'))
+            if ROLE_LEVELS.get(user['role'], 0) < ROLE_LEVELS[role]:
+                flash('权限不足！', 'danger')
+                return redirect(url_for('index'))
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+# 登录即可访问（教师及以上）
+login_required = role_required('teacher')
+
+
+# 单个请求的性能分析
+# 管理员请求时带上 X-Profile: 1 请求头或 ?_profile=1 参数，本次请求在 cProfile 下运行，
+# 结束后把 pstats 文件和执行过的 SQL（语句、参数、耗时）保存到 PROFILE_DIR，响应头 X-Profile-File 给出文件名。
+# cProfile 只跟踪当前线程，不影响同时处理的其他请求；SQL 记录依赖运行指标（METRICS_ENABLED）。
+
+
+def profile_requested():
+    return request.headers.get('X-Profile') == '1' or request.args.get('_profile') == '1'
+
+
+@app.before_request
+def start_profile():
+    if not profile_requested():
+        return
+    user = current_user()
+    if user is None or user['role'] != 'admin':
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 已有其他分析器在运行（例如开发时的调试器）
+        return
+    g.profiler = profiler
+    g.profile_sql = []
+
+
+@app.after_request
+def save_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    start = g.request_start if 'request_start' in g else time.perf_counter()
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_') or 'index'
+    info = {'method': request.method, 'path': request.full_path, 'user': session.get('username')}
+    queries = g.pop('profile_sql')
+    if response.is_streamed and not response.direct_passthrough:
+        # 文件名要放进响应头，流式响应的耗时此时还不知道，只记录在 .sql.json 中
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{slug}_stream"
+        # 发送过程中执行的查询（stream_with_context 保留了 g）同样记录
+        g.profile_sql = queries
+        response.response = ClosingIterable(
+            response.response, lambda: write_profile(profiler, name, info, start, queries))
+    else:
+        elapsed = time.perf_counter() - start
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{slug}_{elapsed * 1000:.0f}ms"
+        write_profile(profiler, name, info, start, queries)
+    response.headers['X-Profile-File'] = name + '.pstats'
+    return response
+
+
+@app.teardown_request
+def stop_profile(exc):
+    # 视图抛出异常时 after_request 不会执行，分析器必须在这里停止，否则会一直留在这个工作线程上
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def write_profile(profiler, name, info, start, queries):
+    profiler.disable()
+    elapsed = time.perf_counter() - start
+    profile_dir = app.config['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(profile_dir, name + '.pstats'))
+    with open(os.path.join(profile_dir, name + '.sql.json'), 'w', encoding='utf-8') as f:
+        json.dump(dict(info, elapsed_ms=round(elapsed * 1000, 3), queries=queries), f, ensure_ascii=False, indent=2)
+    prune_profiles(profile_dir)
+    app.logger.info('已保存性能分析：%s', name)
+
+
+def prune_profiles(profile_dir):
+    files = sorted(f for f in os.listdir(profile_dir) if f.endswith('.pstats'))
+    for filename in files[:-app.config['PROFILE_MAX_FILES']]:
+        base = filename[:-len('.pstats')]
+        for suffix in ('.pstats', '.sql.json'):
+            try:
+                os.remove(os.path.join(profile_dir, base + suffix))
+            except FileNotFoundError:
+                pass
+
+
 # 登录相关功能
+def hash_password(password):
+    return generate_password_hash(password, method=app.config['PASSWORD_HASH_METHOD'])
+
+
+dummy_password_hashes = {}
+
+
+def dummy_password_hash():
+    # 用户名不存在时用来校验的固定哈希，按当前的哈希配置生成一次
+    method = app.config['PASSWORD_HASH_METHOD']
+    if method not in dummy_password_hashes:
+        dummy_password_hashes[method] = generate_password_hash(secrets.token_hex(16), method=method)
+    return dummy_password_hashes[method]
+
+
+def needs_rehash(password_hash):
+    # werkzeug 的哈希格式为 方法:参数$盐$摘要
+    return password_hash.split('$', 1)[0] != app.config['PASSWORD_HASH_METHOD']
+
+
+class LoginLimiter:
+    # 按用户名和IP记录最近的失败时间，超过各自的次数后在哈希校验之前直接拒绝；
+    # 只跟踪最近活跃的 LOGIN_LIMITER_SIZE 个键，内存有上限
+    def __init__(self):
+        self.failures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _recent(self, key, now):
+        window = app.config['LOGIN_WINDOW']
+        attempts = [t for t in self.failures.get(key, ()) if now - t < window]
+        if attempts:
+            self.failures[key] = attempts
+            self.failures.move_to_end(key)
+        else:
+            self.failures.pop(key, None)
+        return attempts
+
+    def is_blocked(self, limits):
+        # limits: {键: 允许的失败次数}
+        now = time.time()
+        with self.lock:
+            return any(len(self._recent(key, now)) >= limit for key, limit in limits.items())
+
+    def record_failure(self, *keys):
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                self.failures[key] = self._recent(key, now) + [now]
+                self.failures.move_to_end(key)
+            while len(self.failures) > app.config['LOGIN_LIMITER_SIZE']:
+                self.failures.popitem(last=False)
+
+    def reset(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.failures.pop(key, None)
+
+
+login_limiter = LoginLimiter()
+
+
+def login_limits(username):
+    return {f'user:{username}': app.config['LOGIN_MAX_ATTEMPTS'],
+            f'ip:{request.remote_addr}': app.config['LOGIN_MAX_ATTEMPTS_PER_IP']}
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.old_sid = None
+
+    def regenerate(self):
+        # 换一个新的会话ID，旧ID对应的记录在保存时删除
+        if not self.new:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class DatabaseSessionInterface(SessionInterface):
+    # 会话内容保存在 user_session 表中，Cookie 里只有一个随机会话ID，
+    # 避免登录状态和 flash 消息让 Cookie 越来越大；读写不经过请求的 db.session
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            table = UserSession.__table__
+            with db.engines[None].connect() as conn:
+                row = conn.execute(db.select(table.c.data).where(
+                    table.c.sid == sid, table.c.expires_at > datetime.now())).first()
+            if row is not None:
+                return ServerSideSession(json.loads(row.data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        table = UserSession.__table__
+        if not session:
+            if session.modified and (not session.new or session.old_sid):
+                with db.engines[None].begin() as conn:
+                    conn.execute(table.delete().where(table.c.sid.in_([session.sid, session.old_sid])))
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        expires_at = datetime.now() + app.permanent_session_lifetime
+        data = json.dumps(dict(session), ensure_ascii=False, default=json_default)
+        with db.engines[None].begin() as conn:
+            if session.old_sid:
+                conn.execute(table.delete().where(table.c.sid == session.old_sid))
+            updated = conn.execute(table.update().where(table.c.sid == session.sid)
+                                   .values(data=data, expires_at=expires_at)).rowcount
+            if not updated:
+                conn.execute(table.insert().values(sid=session.sid, data=data, expires_at=expires_at))
+            # 顺便清理过期会话
+            if random.random() < 0.01:
+                conn.execute(table.delete().where(table.c.expires_at < datetime.now()))
+        response.set_cookie(
+            cookie_name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+if app.config['SESSION_BACKEND'] == 'server':
+    app.session_interface = DatabaseSessionInterface()
+
+
+def reset_session():
+    # 登录和退出时清空会话并更换会话ID，登录前拿到（或被植入）的会话ID不能继续使用；
+    # 签名 Cookie 的内容清空后整个 Cookie 都会改变
+    session.clear()
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        user = User.query.filter_by(username=username).first()
+        limits = login_limits(username)
+        if login_limiter.is_blocked(limits):
+            flash('登录失败次数过多，请稍后再试！', 'danger')
+            return redirect(url_for('login'))
 
-        if user and check_password_hash(user.password, password):
+        user = User.query.filter_by(username=username).first()
+        # 用户名不存在时同样做一次哈希校验，响应时间不会暴露用户名是否存在
+        password_ok = check_password_hash(user.password if user else dummy_password_hash(), password)
+
+        if user and password_ok:
+            # 只清除该用户名的失败记录，IP的记录不能靠登录自己的账号清零
+            login_limiter.reset(f'user:{username}')
+            # 哈希算法或参数调整后，用户下次登录时自动按新配置重新哈希
+            if needs_rehash(user.password):
+                user.password = hash_password(password)
+                db.session.commit()
+            reset_session()
             session['logged_in'] = True
             session['username'] = username
-            session['role'] = user.role
             flash('登录成功！', 'success')
             return redirect(url_for('index'))
+        login_limiter.record_failure(*limits)
         flash('用户名或密码错误！', 'danger')
 
     return f"""
@@ -207,20 +1394,196 @@ def login():
 
 @app.route('/logout')
 def logout():
-    session.clear()
+    reset_session()
     flash('已退出登录！', 'info')
     return redirect(url_for('login'))
 
+# 学校/班级分区
+# 学生按 (学校, 班级) 分区。/list、/stats、排序和各导出接受 ?school=&class= 参数，只处理一个学校或班级；
+# 查询走以分区键开头的索引，代价只与该分区的人数有关，与数据库中有多少个学校无关。
+# 统计数据预先计算在 partition_stats 表中：每次先用一条只读索引的查询取出各分区的“人数|最后修改时间”，
+# 与保存的 version 一致时直接使用，否则只重新计算变化的分区（一条 GROUP BY）。
+NO_PARTITION = (None, None)
+PARTITION_FIELDS = ('school', 'class_name')
+GRADE_BUCKETS = (('fail', None, 60), ('pass', 60, 70), ('good', 70, 85), ('excellent', 85, None))
+PARTITION_REFRESH_IN_LIMIT = 500     # 需要重新计算的分区较多时直接按范围整体计算，不再逐个列出
+
+
+def current_partition():
+    # 参数不存在表示不限；空字符串表示未填写学校或未分班的学生
+    school = request.args.get('school')
+    class_name = request.args.get('class')
+    return (school.strip() if school is not None else None,
+            class_name.strip() if class_name is not None else None)
+
+
+def partition_where(query, partition, model=None):
+    model = model or Student
+    school, class_name = partition
+    if school is not None:
+        query = query.where(model.school == school)
+    if class_name is not None:
+        query = query.where(model.class_name == class_name)
+    return query
+
+
+def partition_args(partition):
+    school, class_name = partition
+    args = {}
+    if school is not None:
+        args['school'] = school
+    if class_name is not None:
+        args['class'] = class_name
+    return args
+
+
+def partition_url(path, partition, **extra):
+    args = dict(partition_args(partition), **extra)
+    return f'{path}?{urlencode(args)}' if args else path
+
+
+def partition_label(partition):
+    school, class_name = partition
+    if partition == NO_PARTITION:
+        return '全部学生'
+    parts = []
+    if school is not None:
+        parts.append(school or '未填写学校')
+    parts.append('全校' if class_name is None else class_name or '未分班')
+    return ' '.join(parts)
+
+
+def grade_of(score):
+    for name, low, high in GRADE_BUCKETS:
+        if high is None or score < high:
+            return name
+
+
+def grade_condition(column, low, high):
+    if low is None:
+        return column < high
+    if high is None:
+        return column >= low
+    return db.and_(column >= low, column < high)
+
+
+def partition_versions(partition):
+    # 只读取分区键和 updated_at，ix_student_partition 索引即可覆盖
+    query = db.select(Student.school, Student.class_name, db.func.count(Student.id), db.func.max(Student.updated_at)) \
+        .group_by(Student.school, Student.class_name)
+    return {(school, class_name): f'{count}|{last_update}'
+            for school, class_name, count, last_update in db.session.execute(partition_where(query, partition))}
+
+
+def compute_partition_stats(partition, keys, versions):
+    grade_columns = [db.func.sum(db.case((grade_condition(column, low, high), 1), else_=0))
+                     for column in (Student.score1, Student.score2) for _, low, high in GRADE_BUCKETS]
+    query = db.select(
+        Student.school, Student.class_name, db.func.count(Student.id),
+        db.func.sum(Student.score1), db.func.sum(Student.score2),
+        db.func.sum(db.case((db.and_(Student.score1 >= 60, Student.score2 >= 60), 1), else_=0)),
+        *grade_columns,
+    ).group_by(Student.school, Student.class_name)
+    query = partition_where(query, partition)
+    if len(keys) <= PARTITION_REFRESH_IN_LIMIT:
+        query = query.where(db.tuple_(Student.school, Student.class_name).in_(keys))
+    keys = set(keys)
+    now = datetime.now()
+    size = len(GRADE_BUCKETS)
+    rows = []
+    for school, class_name, count, score1_sum, score2_sum, pass_count, *grades in db.session.execute(query):
+        if (school, class_name) not in keys:
+            continue
+        rows.append({
+            'school': school, 'class_name': class_name, 'version': versions[(school, class_name)],
+            'student_count': count, 'score1_sum': score1_sum or 0, 'score2_sum': score2_sum or 0,
+            'pass_count': pass_count or 0,
+            'grade_counts': json.dumps({'score1': grades[:size], 'score2': grades[size:]}),
+            'refreshed_at': now,
+        })
+    return rows
+
+
+def partition_stats(partition):
+    # 返回分区范围内各项统计的合计；只有版本变化的分区才重新计算并写回 partition_stats
+    versions = partition_versions(partition)
+    stored = {(r.school, r.class_name): r for r in db.session.execute(partition_where(
+        db.select(PartitionStats.school, PartitionStats.class_name, PartitionStats.version,
+                  PartitionStats.student_count, PartitionStats.score1_sum, PartitionStats.score2_sum,
+                  PartitionStats.pass_count, PartitionStats.grade_counts), partition, PartitionStats))}
+    stale = [key for key, version in versions.items() if key not in stored or stored[key].version != version]
+    gone = [key for key in stored if key not in versions]
+    rows = [r._asdict() for key, r in stored.items() if key in versions and key not in stale]
+    if stale or gone:
+        fresh = compute_partition_stats(partition, stale, versions) if stale else []
+        rows += fresh
+        for i in range(0, len(fresh), 500):
+            upsert_rows(PartitionStats, fresh[i:i + 500], ['school', 'class_name'],
+                        ['version', 'student_count', 'score1_sum', 'score2_sum', 'pass_count',
+                         'grade_counts', 'refreshed_at'])
+        if gone:
+            db.session.execute(PartitionStats.__table__.delete().where(
+                db.tuple_(PartitionStats.school, PartitionStats.class_name).in_(gone)))
+        db.session.commit()
+
+    totals = {'count': 0, 'score1_sum': 0, 'score2_sum': 0, 'pass_count': 0,
+              'grades': {'score1': [0] * len(GRADE_BUCKETS), 'score2': [0] * len(GRADE_BUCKETS)}}
+    for r in rows:
+        totals['count'] += r['student_count']
+        totals['score1_sum'] += r['score1_sum']
+        totals['score2_sum'] += r['score2_sum']
+        totals['pass_count'] += r['pass_count']
+        for field, counts in json.loads(r['grade_counts']).items():
+            totals['grades'][field] = [a + b for a, b in zip(totals['grades'][field], counts)]
+    return totals
+
+
+def touch_partitions(keys):
+    # 新出现的分区先登记一行（version 为空，第一次查看时计算），下拉框中即可选择；已有的分区不变
+    upsert_rows(PartitionStats, [{'school': school, 'class_name': class_name, 'version': '',
+                                  'student_count': 0, 'score1_sum': 0, 'score2_sum': 0, 'pass_count': 0,
+                                  'grade_counts': '{}'} for school, class_name in sorted(set(keys))],
+                ['school', 'class_name'], [])
+
+
+def partition_selector(path, partition):
+    # 下拉框列出已登记的学校，以及所选学校的班级（选项数量不随学校数增长）；
+    # 只有一个分区（所有学生都没有填写学校和班级）时不显示
+    school = partition[0]
+    class_column = db.case((PartitionStats.school == school, PartitionStats.class_name), else_=None) \
+        if school is not None else db.null()
+    keys = db.session.execute(db.select(PartitionStats.school, class_column).distinct()
+                              .order_by(PartitionStats.school, class_column)).all()
+    if len(keys) < 2 and partition == NO_PARTITION:
+        return ''
+    options = [NO_PARTITION]
+    for key in keys:
+        if (key[0], None) not in options:
+            options.append((key[0], None))
+        if key[1] is not None:
+            options.append(tuple(key))
+    if partition not in options:
+        options.append(partition)
+    items = ''.join(
+        f'<option value="{xml_escape(partition_url(path, option))}"{" selected" if option == partition else ""}>'
+        f'{xml_escape(partition_label(option))}</option>' for option in options)
+    return f"""
+    <div class="form-inline mb-3">
+        <label class="mr-2">学校/班级</label>
+        <select class="form-control form-control-sm" onchange="location.href = this.value">{items}</select>
+    </div>
+    """
+
+
 # 首页
 @app.route('/')
+@login_required
 def index():
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
-
     # 获取基础统计数据
-    total_students = Student.query.count()
-    avg_score = db.session.query(db.func.avg(Student.score1 + Student.score2)).scalar() or 0
-    pass_count = Student.query.filter(Student.score1 >= 60, Student.score2 >= 60).count()
+    stats = index_stats()
+    total_students = stats['total_students']
+    avg_score = stats['avg_score']
+    pass_count = stats['pass_count']
 
     return f"""
     {html_header()}
@@ -279,7 +1642,7 @@ def index():
                                 </tr>
                             </thead>
                             <tbody>
-                                {generate_recent_students_table()}
+                                {generate_recent_students_table(stats['recent'])}
                             </tbody>
                         </table>
                     </div>
@@ -290,34 +1653,58 @@ def index():
     {html_footer()}
     """
 
-def generate_recent_students_table():
-    recent_students = Student.query.order_by(Student.created_at.desc()).limit(5).all()
+# 首页统计按数据版本缓存，数据不变时只需要一次版本查询
+index_stats_cache = {}
+
+
+def index_stats():
+    version = data_version()
+    cached = index_stats_cache.get('index')
+    if cached and cached[0] == version:
+        return cached[1]
+    stats = {
+        'total_students': Student.query.count(),
+        'avg_score': db.session.query(db.func.avg(Student.score1 + Student.score2)).scalar() or 0,
+        'pass_count': Student.query.filter(Student.score1 >= 60, Student.score2 >= 60).count(),
+        'recent': [(s.sno, s.name, s.created_at)
+                   for s in Student.query.order_by(Student.created_at.desc()).limit(5).all()],
+    }
+    index_stats_cache['index'] = (version, stats)
+    return stats
+
+
+def generate_recent_students_table(recent_students):
     rows = ""
-    for student in recent_students:
+    for sno, name, created_at in recent_students:
         rows += f"""
         <tr>
-            <td>{student.sno}</td>
-            <td>{student.name}</td>
-            <td>{student.created_at.strftime('%Y-%m-%d %H:%M')}</td>
+            <td>{sno}</td>
+            <td>{name}</td>
+            <td>{created_at.strftime('%Y-%m-%d %H:%M')}</td>
         </tr>
         """
     return rows
 
 # 添加学生
 @app.route('/add', methods=['GET', 'POST'])
+@login_required
 def add_student():
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
-
     if request.method == 'POST':
         sno = request.form.get('sno', '').strip()
         name = request.form.get('name', '').strip()
+        school = request.form.get('school', '').strip()[:80]
+        class_name = request.form.get('class_name', '').strip()[:80]
         try:
             score1 = float(request.form.get('score1', ''))
             score2 = float(request.form.get('score2', ''))
         except ValueError:
             flash('成绩必须是数字！', 'danger')
             return redirect(url_for('add_student'))
+        try:
+            exam_date = parse_exam_date(request.form.get('exam_date'))
+        except ValueError:
+            flash('考试日期格式不正确！', 'danger')
+            return redirect(url_for('add_student'))
 
         if not sno or not name:
             flash('学号和姓名不能为空！', 'danger')
@@ -329,8 +1716,14 @@ def add_student():
             return redirect(url_for('add_student'))
 
         # 创建新学生记录
-        new_student = Student(sno=sno, name=name, score1=score1, score2=score2)
+        new_student = Student(sno=sno, name=name, score1=score1, score2=score2,
+                              school=school, class_name=class_name)
         db.session.add(new_student)
+        db.session.flush()
+        record_scores([(new_student.id, score1, score2)], exam_date)
+        touch_partitions([(school, class_name)])
+        audit('add', sno, new={'name': name, 'score1': score1, 'score2': score2,
+                               'school': school, 'class_name': class_name})
         db.session.commit()
 
         flash('学生添加成功！', 'success')
@@ -351,6 +1744,14 @@ def add_student():
                             <label>姓名</label>
                             <input type="text" class="form-control" name="name" required>
                         </div>
+                        <div class="form-group">
+                            <label>学校</label>
+                            <input type="text" class="form-control" name="school" maxlength="80">
+                        </div>
+                        <div class="form-group">
+                            <label>班级</label>
+                            <input type="text" class="form-control" name="class_name" maxlength="80">
+                        </div>
                         <div class="form-group">
                             <label>课程1成绩</label>
                             <input type="number" class="form-control" name="score1" step="0.1" required>
@@ -359,6 +1760,10 @@ def add_student():
                             <label>课程2成绩</label>
                             <input type="number" class="form-control" name="score2" step="0.1" required>
                         </div>
+                        <div class="form-group">
+                            <label>考试日期</label>
+                            <input type="date" class="form-control" name="exam_date" value="{date.today().isoformat()}">
+                        </div>
                         <button type="submit" class="btn btn-primary"><i class="fas fa-save"></i> 保存</button>
                         <a href="/list" class="btn btn-secondary"><i class="fas fa-times"></i> 取消</a>
                     </form>
@@ -372,12 +1777,11 @@ def add_student():
 # 学生列表
 @app.route('/list')
 @app.route('/list/<sort_by>')
+@login_required
 def list_students(sort_by='sno'):
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
-
     # 获取排序方向
     sort_direction = request.args.get('direction', 'asc')
+    partition = current_partition()
 
     # 定义排序规则
     sort_rules = {
@@ -392,23 +1796,36 @@ def list_students(sort_by='sno'):
     sort_column = sort_rules.get(sort_by, Student.sno)
 
     # 应用排序
+    query = partition_where(Student.query, partition)
     if sort_by == 'total':
         # 对总分特殊处理
-        students = Student.query.all()
+        students = query.all()
         students = sorted(students,
                           key=lambda x: (x.score1 + x.score2),
                           reverse=(sort_direction == 'desc'))
     else:
         # 其他列的排序
         if sort_direction == 'desc':
-            students = Student.query.order_by(sort_column.desc()).all()
+            students = query.order_by(sort_column.desc()).all()
         else:
-            students = Student.query.order_by(sort_column.asc()).all()
+            students = query.order_by(sort_column.asc()).all()
 
     # 生成排序链接
     def get_sort_link(column):
         new_direction = 'desc' if sort_by == column and sort_direction == 'asc' else 'asc'
-        return f'/list/{column}?direction={new_direction}'
+        return partition_url(f'/list/{column}', partition, direction=new_direction)
+
+    # 选择了学校或班级时，可以直接导出该分区
+    export_links = ''
+    if partition != NO_PARTITION:
+        export_links = f"""
+        <div class="mb-3">
+            <a href="{xml_escape(partition_url('/export_csv', partition))}" class="btn btn-sm btn-success"><i class="fas fa-file-export"></i> 导出CSV</a>
+            <a href="{xml_escape(partition_url('/export_xlsx', partition))}" class="btn btn-sm btn-primary"><i class="fas fa-file-excel"></i> 导出Excel</a>
+            <a href="{xml_escape(partition_url('/stats', partition))}" class="btn btn-sm btn-info"><i class="fas fa-chart-bar"></i> 统计分析</a>
+            <a href="{xml_escape(partition_url('/sort_save', partition))}" class="btn btn-sm btn-secondary"><i class="fas fa-sort-amount-down"></i> 排名</a>
+        </div>
+        """
 
     # 生成排序图标
     def get_sort_icon(column):
@@ -424,6 +1841,7 @@ def list_students(sort_by='sno'):
         <tr>
             <td>{student.sno}</td>
             <td>{student.name}</td>
+            <td>{xml_escape(f'{student.school} {student.class_name}'.strip())}</td>
             <td>{student.score1}</td>
             <td>{student.score2}</td>
             <td>{total}</td>
@@ -444,6 +1862,8 @@ def list_students(sort_by='sno'):
 
     return f"""
     {html_header("学生列表")}
+    {partition_selector('/list', partition)}
+    {export_links}
     <div class="card">
         <div class="card-body">
             <div class="table-responsive">
@@ -460,6 +1880,7 @@ def list_students(sort_by='sno'):
                                     姓名 <i class="fas {get_sort_icon('name')}"></i>
                                 </a>
                             </th>
+                            <th>班级</th>
                             <th>
                                 <a href="{get_sort_link('score1')}" class="text-white" style="text-decoration: none">
                                     课程1成绩 <i class="fas {get_sort_icon('score1')}"></i>
@@ -507,10 +1928,8 @@ def list_students(sort_by='sno'):
 
 # 编辑学生
 @app.route('/edit/<sno>', methods=['GET', 'POST'])
+@login_required
 def edit_student(sno):
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
-
     student = Student.query.filter_by(sno=sno).first()
     if not student:
         flash('未找到该学生！', 'danger')
@@ -518,20 +1937,37 @@ def edit_student(sno):
 
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
+        school = request.form.get('school', student.school).strip()[:80]
+        class_name = request.form.get('class_name', student.class_name).strip()[:80]
         try:
             score1 = float(request.form.get('score1', ''))
             score2 = float(request.form.get('score2', ''))
         except ValueError:
             flash('成绩必须是数字！', 'danger')
             return redirect(url_for('edit_student', sno=sno))
+        try:
+            exam_date = parse_exam_date(request.form.get('exam_date'))
+        except ValueError:
+            flash('考试日期格式不正确！', 'danger')
+            return redirect(url_for('edit_student', sno=sno))
 
         if not name:
             flash('姓名不能为空！', 'danger')
             return redirect(url_for('edit_student', sno=sno))
 
+        old_values = {k: getattr(student, k) for k in AUDIT_FIELDS}
+        if (score1, score2) != (student.score1, student.score2):
+            # 成绩有变化时记为一次考试，以前的成绩保留在历史中
+            record_scores([(student.id, score1, score2)], exam_date)
         student.name = name
         student.score1 = score1
         student.score2 = score2
+        if (school, class_name) != (student.school, student.class_name):
+            student.school = school
+            student.class_name = class_name
+            touch_partitions([(school, class_name)])
+        audit('edit', sno, old=old_values, new={'name': name, 'score1': score1, 'score2': score2,
+                                                'school': school, 'class_name': class_name})
         db.session.commit()
 
         flash('修改成功！', 'success')
@@ -552,6 +1988,14 @@ def edit_student(sno):
                             <label>姓名</label>
                             <input type="text" class="form-control" name="name" value="{student.name}" required>
                         </div>
+                        <div class="form-group">
+                            <label>学校</label>
+                            <input type="text" class="form-control" name="school" value="{xml_escape(student.school, {'"': '&quot;'})}" maxlength="80">
+                        </div>
+                        <div class="form-group">
+                            <label>班级</label>
+                            <input type="text" class="form-control" name="class_name" value="{xml_escape(student.class_name, {'"': '&quot;'})}" maxlength="80">
+                        </div>
                         <div class="form-group">
                             <label>课程1成绩</label>
                             <input type="number" class="form-control" name="score1" value="{student.score1}" step="0.1" required>
@@ -560,6 +2004,11 @@ def edit_student(sno):
                             <label>课程2成绩</label>
                             <input type="number" class="form-control" name="score2" value="{student.score2}" step="0.1" required>
                         </div>
+                        <div class="form-group">
+                            <label>考试日期</label>
+                            <input type="date" class="form-control" name="exam_date" value="{date.today().isoformat()}">
+                            <small class="form-text text-muted">修改成绩时作为一次新的考试记入成绩历史</small>
+                        </div>
                         <button type="submit" class="btn btn-primary"><i class="fas fa-save"></i> 保存修改</button>
                         <a href="/list" class="btn btn-secondary"><i class="fas fa-times"></i> 取消</a>
                     </form>
@@ -572,12 +2021,12 @@ def edit_student(sno):
 
 # 删除学生
 @app.route('/delete/<sno>')
+@login_required
 def delete_student(sno):
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
-
     student = Student.query.filter_by(sno=sno).first()
     if student:
+        audit('delete', sno, old={k: getattr(student, k) for k in AUDIT_FIELDS})
+        db.session.execute(ScoreHistory.__table__.delete().where(ScoreHistory.student_id == student.id))
         db.session.delete(student)
         db.session.commit()
         flash('学生已删除！', 'success')
@@ -585,84 +2034,138 @@ def delete_student(sno):
         flash('未找到该学生！', 'danger')
     return redirect(url_for('list_students'))
 
+# 审计日志
+# 按 id 倒序分页（before=上一页最后一条的 id），翻页不需要 COUNT 和 OFFSET
+AUDIT_PAGE_SIZE = 50
+AUDIT_ACTIONS = {'add': '添加', 'edit': '修改', 'delete': '删除', 'import': '导入'}
+
+
+def format_audit_value(value):
+    if not value:
+        return '-'
+    return ', '.join(f'{k}={v}' for k, v in json.loads(value).items())
+
+
+@app.route('/audit')
+@role_required('admin')
+def audit_log():
+    sno = request.args.get('sno', '').strip()
+    before = request.args.get('before', type=int)
+    query = db.select(AuditLog).order_by(AuditLog.id.desc()).limit(AUDIT_PAGE_SIZE + 1)
+    if sno:
+        query = query.where(AuditLog.sno == sno)
+    if before:
+        query = query.where(AuditLog.id < before)
+    entries = db.session.execute(query).scalars().all()
+    has_more = len(entries) > AUDIT_PAGE_SIZE
+    entries = entries[:AUDIT_PAGE_SIZE]
+
+    rows = ''.join(f"""
+        <tr>
+            <td>{e.created_at.strftime('%Y-%m-%d %H:%M:%S')}</td>
+            <td>{xml_escape(e.username)}</td>
+            <td>{AUDIT_ACTIONS.get(e.action, e.action)}</td>
+            <td><a href="/audit?{urlencode({'sno': e.sno})}">{xml_escape(e.sno)}</a></td>
+            <td>{xml_escape(format_audit_value(e.old_value))}</td>
+            <td>{xml_escape(format_audit_value(e.new_value))}</td>
+        </tr>
+        """ for e in entries)
+    pager = ''
+    if before:
+        pager += f'<a href="/audit?{urlencode({"sno": sno})}" class="btn btn-outline-secondary btn-sm">最新</a> '
+    if has_more:
+        pager += (f'<a href="/audit?{urlencode({"sno": sno, "before": entries[-1].id})}" '
+                  f'class="btn btn-outline-primary btn-sm">下一页</a>')
+
+    return f"""
+    {html_header("审计日志")}
+    <div class="card">
+        <div class="card-body">
+            <form method="get" class="form-inline mb-3">
+                <input type="text" class="form-control mr-2" name="sno" value="{xml_escape(sno)}" placeholder="按学号筛选">
+                <button type="submit" class="btn btn-primary"><i class="fas fa-search"></i> 查询</button>
+            </form>
+            <div class="table-responsive">
+                <table class="table table-sm table-striped">
+                    <thead class="thead-dark">
+                        <tr>
+                            <th>时间</th>
+                            <th>用户</th>
+                            <th>操作</th>
+                            <th>学号</th>
+                            <th>修改前</th>
+                            <th>修改后</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {rows or '<tr><td colspan="6" class="text-center text-muted">暂无记录</td></tr>'}
+                    </tbody>
+                </table>
+            </div>
+            {pager}
+        </div>
+    </div>
+    {html_footer()}
+    """
+
 # 统计分析
+# /stats 只返回页面框架（不查询学生），人数、平均分和图表数据由页面脚本从 /stats/chart 取得（来自预先计算的分区统计），
+# 点击等级行时再从 /stats/students 按学号分页取出该等级的学生，页面大小和耗时与学生数量无关。
+STATS_PAGE_SIZE = 50
+STATS_COURSES = {'1': 'score1', '2': 'score2'}
+
+
+@app.route('/stats/chart')
+@login_required
+@read_only_route
+def stats_chart():
+    aggregates = partition_stats(current_partition())
+    total = aggregates['count']
+    return {
+        'count': total,
+        'averages': {course: aggregates[f'{field}_sum'] / total if total else 0
+                     for course, field in STATS_COURSES.items()},
+        'labels': ['0-59', '60-69', '70-84', '85-100'],
+        'grades': [name for name, _, _ in GRADE_BUCKETS],
+        'series': {course: aggregates['grades'][field] for course, field in STATS_COURSES.items()},
+    }
+
+
+@app.route('/stats/students')
+@login_required
+@read_only_route
+def stats_students():
+    # 按学号的键集分页：after 为上一页最后一个学号，走 (school, class_name, sno) 索引
+    field = STATS_COURSES.get(request.args.get('course', ''))
+    bucket = next((b for b in GRADE_BUCKETS if b[0] == request.args.get('grade')), None)
+    if field is None or bucket is None:
+        return {'error': 'course 只能是 1 或 2，grade 只能是 ' + '、'.join(b[0] for b in GRADE_BUCKETS)}, 400
+    column = getattr(Student, field)
+    query = partition_where(
+        db.select(Student.sno, Student.name, column).where(grade_condition(column, bucket[1], bucket[2])),
+        current_partition())
+    after = request.args.get('after')
+    if after:
+        query = query.where(Student.sno > after)
+    rows = db.session.execute(query.order_by(Student.sno).limit(STATS_PAGE_SIZE + 1)).all()
+    students = [{'sno': sno, 'name': name, 'score': score} for sno, name, score in rows[:STATS_PAGE_SIZE]]
+    return {'students': students, 'next': students[-1]['sno'] if len(rows) > STATS_PAGE_SIZE else None}
+
+
 @app.route('/stats')
+@login_required
+@read_only_route
 def stats():
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
-
-    students = Student.query.all()
-    if not students:
-        return f"{html_header('统计分析')}<p>当前没有学生数据。</p>{html_footer()}"
-
-    total = len(students)
-
-    # 计算统计数据
-    total_scores = [s.score1 + s.score2 for s in students]
-    avg_score = sum(total_scores) / len(total_scores)
-
-    # 计算课程1的等级分布
-    def get_grade_stats(scores, students, score_field):
-        fail = []
-        pass_list = []
-        good = []
-        excellent = []
-
-        for i, score in enumerate(scores):
-            student = students[i]
-            student_info = {
-                'sno': student.sno,
-                'name': student.name,
-                'score': score
-            }
-            if score < 60:
-                fail.append(student_info)
-            elif score < 70:
-                pass_list.append(student_info)
-            elif score < 85:
-                good.append(student_info)
-            else:
-                excellent.append(student_info)
-
-        return {
-            'fail': fail,
-            'fail_count': len(fail),
-            'fail_rate': (len(fail) / total * 100) if total > 0 else 0,
-            'pass': pass_list,
-            'pass_count': len(pass_list),
-            'pass_rate': (len(pass_list) / total * 100) if total > 0 else 0,
-            'good': good,
-            'good_count': len(good),
-            'good_rate': (len(good) / total * 100) if total > 0 else 0,
-            'excellent': excellent,
-            'excellent_count': len(excellent),
-            'excellent_rate': (len(excellent) / total * 100) if total > 0 else 0
-        }
-
-    score1_stats = get_grade_stats([s.score1 for s in students], students, 'score1')
-    score2_stats = get_grade_stats([s.score2 for s in students], students, 'score2')
-
-    # 计算课程平均分
-    avg_score1 = sum(s.score1 for s in students) / total if total > 0 else 0
-    avg_score2 = sum(s.score2 for s in students) / total if total > 0 else 0
-
-    # 成绩分布统计
-    score_ranges = ['0-59', '60-69', '70-84', '85-100']
-    score1_dist = [score1_stats['fail_count'], score1_stats['pass_count'],
-                   score1_stats['good_count'], score1_stats['excellent_count']]
-    score2_dist = [score2_stats['fail_count'], score2_stats['pass_count'],
-                   score2_stats['good_count'], score2_stats['excellent_count']]
-
-    return f"""
-    {html_header('统计分析')}
-    <div class="container mt-4">
-        <h2 class="text-center mb-4">成绩统计分析</h2>
+    partition = current_partition()
+    selector = partition_selector('/stats', partition)
+    query = xml_escape(urlencode(partition_args(partition)))
 
-        <div class="row">
+    def grade_table(course, color, title):
+        return f"""
             <div class="col-md-6">
                 <div class="card mb-4">
-                    <div class="card-header bg-primary text-white">
-                        <h5 class="card-title mb-0">课程1成绩分布</h5>
+                    <div class="card-header bg-{color} text-white">
+                        <h5 class="card-title mb-0">{title}</h5>
                     </div>
                     <div class="card-body">
                         <div class="table-responsive">
@@ -675,29 +2178,29 @@ def stats():
                                     </tr>
                                 </thead>
                                 <tbody>
-                                    <tr class="table-danger grade-row" data-course="1" data-grade="fail">
+                                    <tr class="table-danger grade-row" data-course="{course}" data-grade="fail">
                                         <td>不及格 (<60分)</td>
-                                        <td>{score1_stats['fail_count']}人</td>
-                                        <td>{score1_stats['fail_rate']:.1f}%</td>
+                                        <td>-</td>
+                                        <td>-</td>
                                     </tr>
-                                    <tr class="table-warning grade-row" data-course="1" data-grade="pass">
+                                    <tr class="table-warning grade-row" data-course="{course}" data-grade="pass">
                                         <td>及格 (60-69分)</td>
-                                        <td>{score1_stats['pass_count']}人</td>
-                                        <td>{score1_stats['pass_rate']:.1f}%</td>
+                                        <td>-</td>
+                                        <td>-</td>
                                     </tr>
-                                    <tr class="table-info grade-row" data-course="1" data-grade="good">
+                                    <tr class="table-info grade-row" data-course="{course}" data-grade="good">
                                         <td>良好 (70-84分)</td>
-                                        <td>{score1_stats['good_count']}人</td>
-                                        <td>{score1_stats['good_rate']:.1f}%</td>
+                                        <td>-</td>
+                                        <td>-</td>
                                     </tr>
-                                    <tr class="table-success grade-row" data-course="1" data-grade="excellent">
+                                    <tr class="table-success grade-row" data-course="{course}" data-grade="excellent">
                                         <td>优秀 (≥85分)</td>
-                                        <td>{score1_stats['excellent_count']}人</td>
-                                        <td>{score1_stats['excellent_rate']:.1f}%</td>
+                                        <td>-</td>
+                                        <td>-</td>
                                     </tr>
                                     <tr class="table-active">
                                         <td><strong>总计</strong></td>
-                                        <td><strong>{total}人</strong></td>
+                                        <td><strong class="stats-total">-</strong></td>
                                         <td><strong>100%</strong></td>
                                     </tr>
                                 </tbody>
@@ -706,54 +2209,19 @@ def stats():
                     </div>
                 </div>
             </div>
+        """
 
-            <div class="col-md-6">
-                <div class="card mb-4">
-                    <div class="card-header bg-success text-white">
-                        <h5 class="card-title mb-0">课程2成绩分布</h5>
-                    </div>
-                    <div class="card-body">
-                        <div class="table-responsive">
-                            <table class="table table-bordered">
-                                <thead>
-                                    <tr>
-                                        <th>等级</th>
-                                        <th>人数</th>
-                                        <th>比例</th>
-                                    </tr>
-                                </thead>
-                                <tbody>
-                                    <tr class="table-danger grade-row" data-course="2" data-grade="fail">
-                                        <td>不及格 (<60分)</td>
-                                        <td>{score2_stats['fail_count']}人</td>
-                                        <td>{score2_stats['fail_rate']:.1f}%</td>
-                                    </tr>
-                                    <tr class="table-warning grade-row" data-course="2" data-grade="pass">
-                                        <td>及格 (60-69分)</td>
-                                        <td>{score2_stats['pass_count']}人</td>
-                                        <td>{score2_stats['pass_rate']:.1f}%</td>
-                                    </tr>
-                                    <tr class="table-info grade-row" data-course="2" data-grade="good">
-                                        <td>良好 (70-84分)</td>
-                                        <td>{score2_stats['good_count']}人</td>
-                                        <td>{score2_stats['good_rate']:.1f}%</td>
-                                    </tr>
-                                    <tr class="table-success grade-row" data-course="2" data-grade="excellent">
-                                        <td>优秀 (≥85分)</td>
-                                        <td>{score2_stats['excellent_count']}人</td>
-                                        <td>{score2_stats['excellent_rate']:.1f}%</td>
-                                    </tr>
-                                    <tr class="table-active">
-                                        <td><strong>总计</strong></td>
-                                        <td><strong>{total}人</strong></td>
-                                        <td><strong>100%</strong></td>
-                                    </tr>
-                                </tbody>
-                            </table>
-                        </div>
-                    </div>
-                </div>
-            </div>
+    return f"""
+    {html_header('统计分析')}
+    <div class="container mt-4" id="statsPage" data-query="{query}">
+        <h2 class="text-center mb-4">成绩统计分析 - {xml_escape(partition_label(partition))}</h2>
+        {selector}
+        <p id="statsEmpty" class="d-none">当前没有学生数据。</p>
+
+        <div id="statsContent">
+        <div class="row">
+            {grade_table(1, 'primary', '课程1成绩分布')}
+            {grade_table(2, 'success', '课程2成绩分布')}
         </div>
 
         <!-- 学生详细信息模态框 -->
@@ -778,6 +2246,7 @@ def stats():
                                 </tbody>
                             </table>
                         </div>
+                        <button type="button" class="btn btn-outline-secondary btn-sm d-none" id="modalMore">加载更多</button>
                     </div>
                 </div>
             </div>
@@ -793,15 +2262,15 @@ def stats():
                         <ul class="list-group">
                             <li class="list-group-item d-flex justify-content-between align-items-center">
                                 学生总数
-                                <span class="badge bg-primary rounded-pill">{total}</span>
+                                <span class="badge bg-primary rounded-pill stats-total">-</span>
                             </li>
                             <li class="list-group-item d-flex justify-content-between align-items-center">
                                 课程1平均分
-                                <span class="badge bg-info rounded-pill">{avg_score1:.2f}</span>
+                                <span class="badge bg-info rounded-pill" id="avgScore1">-</span>
                             </li>
                             <li class="list-group-item d-flex justify-content-between align-items-center">
                                 课程2平均分
-                                <span class="badge bg-info rounded-pill">{avg_score2:.2f}</span>
+                                <span class="badge bg-info rounded-pill" id="avgScore2">-</span>
                             </li>
                         </ul>
                     </div>
@@ -813,82 +2282,100 @@ def stats():
                 </div>
             </div>
         </div>
+        </div>
     </div>
 
     <script>
-    // 图表数据
-    var ctx = document.getElementById('scoreDistChart').getContext('2d');
-    new Chart(ctx, {{
-        type: 'bar',
-        data: {{
-            labels: {score_ranges},
-            datasets: [{{
-                label: '课程1成绩分布',
-                data: {score1_dist},
-                backgroundColor: 'rgba(54, 162, 235, 0.5)',
-                borderColor: 'rgba(54, 162, 235, 1)',
-                borderWidth: 1
+    var statsQuery = new URLSearchParams(document.getElementById('statsPage').dataset.query);
+
+    function statsUrl(path, extra) {{
+        var params = new URLSearchParams(statsQuery);
+        Object.keys(extra || {{}}).forEach(key => params.set(key, extra[key]));
+        var query = params.toString();
+        return query ? path + '?' + query : path;
+    }}
+
+    // 人数、比例、平均分和图表
+    fetch(statsUrl('/stats/chart')).then(response => response.json()).then(data => {{
+        if (!data.count) {{
+            document.getElementById('statsContent').classList.add('d-none');
+            document.getElementById('statsEmpty').classList.remove('d-none');
+            return;
+        }}
+        document.querySelectorAll('.stats-total').forEach(el => el.textContent = data.count + (el.tagName === 'STRONG' ? '人' : ''));
+        document.getElementById('avgScore1').textContent = data.averages['1'].toFixed(2);
+        document.getElementById('avgScore2').textContent = data.averages['2'].toFixed(2);
+        document.querySelectorAll('.grade-row').forEach(row => {{
+            const count = data.series[row.dataset.course][data.grades.indexOf(row.dataset.grade)];
+            row.cells[1].textContent = count + '人';
+            row.cells[2].textContent = (count / data.count * 100).toFixed(1) + '%';
+        }});
+
+        var ctx = document.getElementById('scoreDistChart').getContext('2d');
+        new Chart(ctx, {{
+            type: 'bar',
+            data: {{
+                labels: data.labels,
+                datasets: [{{
+                    label: '课程1成绩分布',
+                    data: data.series['1'],
+                    backgroundColor: 'rgba(54, 162, 235, 0.5)',
+                    borderColor: 'rgba(54, 162, 235, 1)',
+                    borderWidth: 1
+                }},
+                {{
+                    label: '课程2成绩分布',
+                    data: data.series['2'],
+                    backgroundColor: 'rgba(255, 99, 132, 0.5)',
+                    borderColor: 'rgba(255, 99, 132, 1)',
+                    borderWidth: 1
+                }}]
             }},
-            {{
-                label: '课程2成绩分布',
-                data: {score2_dist},
-                backgroundColor: 'rgba(255, 99, 132, 0.5)',
-                borderColor: 'rgba(255, 99, 132, 1)',
-                borderWidth: 1
-            }}]
-        }},
-        options: {{
-            responsive: true,
-            scales: {{
-                y: {{
-                    beginAtZero: true,
-                    ticks: {{
-                        stepSize: 1
+            options: {{
+                responsive: true,
+                scales: {{
+                    y: {{
+                        beginAtZero: true,
+                        ticks: {{
+                            stepSize: 1
+                        }}
                     }}
                 }}
             }}
-        }}
+        }});
     }});
 
-    // 存储成绩数据供JavaScript使用
-    var gradeData = {{
-        '1': {{}},
-        '2': {{}}
-    }};
-
-    // 课程1的数据
-    gradeData['1']['fail'] = {str(score1_stats['fail'])};
-    gradeData['1']['pass'] = {str(score1_stats['pass'])};
-    gradeData['1']['good'] = {str(score1_stats['good'])};
-    gradeData['1']['excellent'] = {str(score1_stats['excellent'])};
-
-    // 课程2的数据
-    gradeData['2']['fail'] = {str(score2_stats['fail'])};
-    gradeData['2']['pass'] = {str(score2_stats['pass'])};
-    gradeData['2']['good'] = {str(score2_stats['good'])};
-    gradeData['2']['excellent'] = {str(score2_stats['excellent'])};
-
-    // 点击成绩等级行显示学生详情
-    document.querySelectorAll('.grade-row').forEach(row => {{
-        row.style.cursor = 'pointer';
-        row.addEventListener('click', function() {{
-            const course = this.getAttribute('data-course');
-            const grade = this.getAttribute('data-grade');
-            const students = gradeData[course][grade];
+    // 点击成绩等级行显示学生详情，每次加载一页，“加载更多”从上一页最后一个学号继续
+    var modalBucket = null;
+    var modalMore = document.getElementById('modalMore');
 
-            // 清空并填充模态框表格
+    function loadStudents(after) {{
+        const extra = Object.assign({{}}, modalBucket, after ? {{after: after}} : {{}});
+        fetch(statsUrl('/stats/students', extra)).then(response => response.json()).then(data => {{
             const tableBody = document.getElementById('modalTableBody');
-            tableBody.innerHTML = '';
-
-            students.forEach(student => {{
+            data.students.forEach(student => {{
                 const row = document.createElement('tr');
-                row.innerHTML = `
-                    <td>${{student.sno}}</td>
-                    <td>${{student.name}}</td>
-                    <td>${{student.score}}</td>
-                `;
+                [student.sno, student.name, student.score].forEach(value => {{
+                    const cell = document.createElement('td');
+                    cell.textContent = value;
+                    row.appendChild(cell);
+                }});
                 tableBody.appendChild(row);
             }});
+            modalMore.dataset.after = data.next || '';
+            modalMore.classList.toggle('d-none', !data.next);
+        }});
+    }}
+
+    modalMore.addEventListener('click', () => loadStudents(modalMore.dataset.after));
+
+    document.querySelectorAll('.grade-row').forEach(row => {{
+        row.style.cursor = 'pointer';
+        row.addEventListener('click', function() {{
+            modalBucket = {{course: this.dataset.course, grade: this.dataset.grade}};
+            document.getElementById('modalTableBody').innerHTML = '';
+            modalMore.classList.add('d-none');
+            loadStudents(null);
 
             // 显示模态框
             new bootstrap.Modal(document.getElementById('studentModal')).show();
@@ -898,16 +2385,505 @@ def stats():
     {html_footer()}
     """
 
+# 成绩趋势
+# /trend 返回 JSON：一次查询取出范围内的全部历史成绩（学号、班级、课程、考试日期、成绩），
+# 在 pandas 中整列计算每个学生和每个班级的移动平均（最近 window 次考试）、与上次考试的差值，以及首末两次的提高幅度。
+# 参数：school、class（分区，同 /list）、sno、course（1 或 2）、start、end（考试日期范围）、window。
+# 只有指定了班级或学号时才返回逐个学生的序列，否则只返回各班级的序列。
+TREND_DEFAULT_WINDOW = 3
+TREND_MAX_WINDOW = 20
+
+
+def trend_series(frame, keys, value, window, extra=()):
+    # frame 已按 keys + exam_date 排序；每组一个序列，各列为数组，前端可以直接画图
+    import pandas as pd
+
+    grouped = frame.groupby(keys, sort=False)[value]
+    moving_avg = grouped.rolling(window, min_periods=1).mean()
+    delta = grouped.diff().round(2)
+    frame = frame.assign(
+        exam_date=frame['exam_date'].astype(str),
+        moving_avg=moving_avg.reset_index(level=list(range(len(keys))), drop=True).round(2),
+        delta=delta.astype(object).where(delta.notna(), None),
+    )
+    to_list = pd.Series.tolist
+    columns = {'dates': ('exam_date', to_list), 'scores': (value, to_list), 'moving_avg': ('moving_avg', to_list),
+               'delta': ('delta', to_list), 'first': (value, 'first'), 'last': (value, 'last')}
+    columns.update({name: (name, to_list) for name in extra})
+    series = frame.groupby(keys, sort=False).agg(**columns).reset_index()
+    series['improvement'] = (series['last'] - series['first']).round(2)
+    return series.drop(columns=['first', 'last']).to_dict('records')
+
+
+@app.route('/trend')
+@login_required
+@read_only_route
+def trend():
+    import pandas as pd
+
+    partition = current_partition()
+    sno = request.args.get('sno', '').strip() or None
+    try:
+        course = int(request.args['course']) if request.args.get('course') else None
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+        window = int(request.args.get('window', TREND_DEFAULT_WINDOW))
+    except ValueError:
+        return {'error': '参数格式不正确'}, 400
+    if course is not None and course not in HISTORY_COURSES:
+        return {'error': 'course 只能是 1 或 2'}, 400
+    window = min(max(window, 1), TREND_MAX_WINDOW)
+
+    query = partition_where(
+        db.select(Student.sno, Student.school, Student.class_name, ScoreHistory.course,
+                  ScoreHistory.exam_date, ScoreHistory.score)
+        .join_from(ScoreHistory, Student, ScoreHistory.student_id == Student.id), partition)
+    if sno is not None:
+        query = query.where(Student.sno == sno)
+    if course is not None:
+        query = query.where(ScoreHistory.course == course)
+    if start is not None:
+        query = query.where(ScoreHistory.exam_date >= start)
+    if end is not None:
+        query = query.where(ScoreHistory.exam_date <= end)
+    frame = pd.DataFrame(db.session.execute(query).all(),
+                         columns=['sno', 'school', 'class_name', 'course', 'exam_date', 'score'])
+
+    result = {'window': window, 'students': [], 'classes': []}
+    if frame.empty:
+        return result
+    if sno is not None or partition[1] is not None:
+        students = frame.assign(score=frame['score'].round(2)).sort_values(['sno', 'course', 'exam_date'])
+        result['students'] = trend_series(students, ['sno', 'course'], 'score', window)
+    # 班级序列：每次考试先求班级平均分，再按考试顺序计算移动平均和差值
+    classes = frame.groupby(['school', 'class_name', 'course', 'exam_date'], as_index=False) \
+        .agg(mean=('score', 'mean'), count=('score', 'size'))
+    classes['mean'] = classes['mean'].round(2)
+    result['classes'] = trend_series(classes, ['school', 'class_name', 'course'], 'mean', window, extra=['count'])
+    return result
+
 # 数据导入导出
+IMPORT_EXTENSIONS = {'.csv', '.xlsx', '.parquet', '.arrow', '.arrows', '.feather', '.zip'}
+# Parquet/Arrow 导出使用英文列名，导入时映射回中文列名
+IMPORT_COLUMN_ALIASES = {'sno': '学号', 'name': '姓名', 'score1': '课程1成绩', 'score2': '课程2成绩',
+                         'school': '学校', 'class_name': '班级'}
+# 可选列：文件中有这两列时同时更新学生所在的学校和班级，没有时保持不变（新学生为空）
+IMPORT_PARTITION_COLUMNS = {'学校': 'school', '班级': 'class_name'}
+IMPORT_DIFF_CHUNK = 10000     # 对比已有数据时每次查询的学号数量，一般的名单只需一次查询
+IMPORT_PREVIEW_ROWS = 50      # 预览页最多列出的修改明细
+
+
+def read_arrow_table(file, file_ext):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if file_ext == '.parquet':
+        return pq.read_table(file)
+    data = pa.py_buffer(file.read())
+    try:
+        return pa.ipc.open_file(data).read_all()
+    except pa.ArrowInvalid:
+        return pa.ipc.open_stream(data).read_all()
+
+
+def read_import_file(file, file_ext):
+    # pandas 导入较慢，只在第一次导入文件时加载
+    import pandas as pd
+
+    # 根据文件类型读取数据
+    if file_ext == '.csv':
+        # 尝试不同的编码方式和分隔符
+        try:
+            # 读取CSV文件
+            df = pd.read_csv(file, encoding='utf-8-sig')  # 使用 utf-8-sig 来自动处理 BOM
+
+            # 确保列名正确（移除可能的BOM标记）
+            df.columns = df.columns.str.replace('\ufeff', '')
+        except Exception:
+            # 如果上面的方法失败，尝试其他编码
+            try:
+                file.seek(0)
+                df = pd.read_csv(file, encoding='gbk')
+                df.columns = df.columns.str.replace('\ufeff', '')
+            except Exception:
+                try:
+                    file.seek(0)
+                    df = pd.read_csv(file, encoding='gb2312')
+                    df.columns = df.columns.str.replace('\ufeff', '')
+                except Exception:
+                    raise ValueError("无法正确读取CSV文件，请检查文件格式和编码")
+    elif file_ext == '.xlsx':
+        df = pd.read_excel(file)
+    else:
+        try:
+            table = read_arrow_table(file, file_ext)
+        except ImportError:
+            raise ValueError("服务器未安装 pyarrow，无法读取 Parquet/Arrow 文件")
+        # 数值列没有空值时直接复用 Arrow 内存，不做逐行转换
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+        df = df.rename(columns=IMPORT_COLUMN_ALIASES)
+    return df
+
+
+def import_cell(value):
+    # 错误报告中保留原始值，空值显示为空字符串
+    if value is None or value != value:
+        return ''
+    return str(value)[:200]
+
+
+def import_text_column(column):
+    return column.where(column.notna(), '').astype(str).str.strip()
+
+
+def validate_import(df):
+    # 整列校验，返回 (有效行, 错误列表)；有效行的列名为 sno/name/score1/score2（以及文件中有的 school/class_name），
+    # 同一学号以最后一行为准
+    # 每个错误是 {'line', 'error', 'sno', 'name', 'score1', 'score2'}，保留原始值供下载
+    import numpy as np
+    import pandas as pd
+
+    frame = pd.DataFrame({
+        'sno': import_text_column(df['学号']),
+        'name': import_text_column(df['姓名']),
+        'score1': pd.to_numeric(df['课程1成绩'], errors='coerce'),
+        'score2': pd.to_numeric(df['课程2成绩'], errors='coerce'),
+    })
+    too_long = pd.Series(False, index=df.index)
+    for column, field in IMPORT_PARTITION_COLUMNS.items():
+        if column in df.columns:
+            frame[field] = import_text_column(df[column])
+            too_long |= frame[field].str.len() > 80
+    not_number = ((frame['score1'].isna() & df['课程1成绩'].notna())
+                  | (frame['score2'].isna() & df['课程2成绩'].notna()))
+    empty = (frame['sno'] == '') | (frame['name'] == '')
+    out_of_range = ~(frame['score1'].between(0, 100) & frame['score2'].between(0, 100))
+    error = np.select([not_number, empty, out_of_range, too_long],
+                      ['成绩必须为数字', '学号或姓名不能为空', '成绩必须在0-100之间', '学校或班级名称超过80个字符'],
+                      default='')
+    bad = error != ''
+
+    error_rows = [
+        {'line': index + 2, 'error': message, 'sno': import_cell(sno), 'name': import_cell(name),
+         'score1': import_cell(score1), 'score2': import_cell(score2)}
+        for index, message, sno, name, score1, score2 in zip(
+            df.index[bad], error[bad], df['学号'][bad], df['姓名'][bad], df['课程1成绩'][bad], df['课程2成绩'][bad])
+    ]
+    valid = frame[~bad].drop_duplicates('sno', keep='last')
+    return valid, error_rows
+
+
+def diff_import(valid):
+    # 与数据库中已有的学生对比：每 IMPORT_DIFF_CHUNK 个学号一次查询，结果在 pandas 中整列比较
+    import pandas as pd
+
+    # 直接在会话的连接上执行 Core 查询，省去 ORM 结果处理的开销
+    # 学校和班级只在文件中有对应的列时参与比较；结果中的 school/class_name 是写入后的值
+    snos = valid['sno'].tolist()
+    columns = ['id', 'sno', 'name', 'score1', 'score2', *PARTITION_FIELDS]
+    conn = db.session.connection()
+    existing = []
+    for i in range(0, len(snos), IMPORT_DIFF_CHUNK):
+        existing += conn.execute(
+            db.select(*[getattr(Student, column) for column in columns])
+            .where(Student.sno.in_(snos[i:i + IMPORT_DIFF_CHUNK]))).all()
+    existing = pd.DataFrame(existing, columns=columns)
+    fields = ('name', 'score1', 'score2') + tuple(field for field in PARTITION_FIELDS if field in valid.columns)
+    merged = valid.merge(existing, on='sno', how='left', suffixes=('', '_old'), indicator=True)
+    merged['is_new'] = merged['_merge'] == 'left_only'
+    for field in PARTITION_FIELDS:
+        # zip 中部分文件没有这一列时为空值，这些学生保持原来的学校或班级
+        if field in valid.columns:
+            merged[field] = merged[field].fillna(merged[f'{field}_old'])
+        merged[field] = merged[field].fillna('')
+    merged['changed'] = False
+    for field in fields:
+        merged[f'{field}_changed'] = ~merged['is_new'] & (merged[field] != merged[f'{field}_old'])
+        merged['changed'] |= merged[f'{field}_changed']
+    return merged
+
+
+def import_summary(diff, total_rows):
+    fields = [field for field in AUDIT_FIELDS if f'{field}_changed' in diff.columns]
+    updated = diff[diff['changed']]
+    samples = []
+    for row in updated.head(IMPORT_PREVIEW_ROWS).itertuples(index=False):
+        row = row._asdict()
+        samples.append((row['sno'], {field: (row[f'{field}_old'], row[field])
+                                     for field in fields if row[f'{field}_changed']}))
+    return {
+        'total': total_rows,
+        'insert': int(diff['is_new'].sum()),
+        'update': len(updated),
+        'unchanged': int((~diff['is_new'] & ~diff['changed']).sum()),
+        'fields': {field: int(diff[f'{field}_changed'].sum()) for field in fields},
+        'samples': samples,
+    }
+
+
+def import_students(df, dry_run=False, exam_date=None):
+    # 校验全部通过后与现有数据对比，只写入新增和有变化的学生；返回 (导入摘要, 错误列表)
+    # dry_run 时只返回摘要，不写数据库；exam_date 见 write_import
+    valid, error_rows = validate_import(df)
+    if error_rows:
+        return None, error_rows
+
+    diff = diff_import(valid)
+    summary = import_summary(diff, len(df))
+    if not dry_run:
+        write_import(diff, exam_date)
+    return summary, []
+
+
+def write_import(diff, exam_date=None):
+    # 已存在的学号更新姓名、成绩和所在班级，不存在的插入新记录；旧值直接来自对比结果，写入审计日志。
+    # 新学生和成绩有变化的学生记入今天的成绩历史；指定了 exam_date 时文件中的全部学生都记为该次考试
+    now = datetime.now()
+    # 文件中没有学校或班级列时没有 *_old 列，这些学生的学校和班级保持不变
+    old_columns = [(field, f'{field}_old' if f'{field}_old' in diff.columns else field) for field in AUDIT_FIELDS]
+    rows, changes = [], []
+    for r in diff[diff['is_new'] | diff['changed']].itertuples(index=False):
+        row = {'sno': r.sno, 'name': r.name, 'score1': float(r.score1), 'score2': float(r.score2),
+               'school': r.school, 'class_name': r.class_name, 'created_at': now, 'updated_at': now}
+        old = None if r.is_new else {field: getattr(r, column) for field, column in old_columns}
+        rows.append(row)
+        changes.append((r.sno, old, row))
+    audit_many('import', changes)
+    touch_partitions((row['school'], row['class_name']) for row in rows)
+    for i in range(0, len(rows), 1000):
+        upsert_rows(Student, rows[i:i + 1000], ['sno'],
+                    ['name', 'score1', 'score2', 'school', 'class_name', 'updated_at'])
+
+    if exam_date is None:
+        scored = diff[diff['is_new'] | diff['score1_changed'] | diff['score2_changed']]
+    else:
+        scored = diff
+    if len(scored):
+        new_ids = student_ids(scored.loc[scored['is_new'], 'sno'])
+        ids = scored['id'].where(~scored['is_new'], scored['sno'].map(new_ids)).astype(int)
+        record_scores(zip(ids.tolist(), scored['score1'].tolist(), scored['score2'].tolist()),
+                      exam_date or date.today())
+
+
+# zip 批量导入
+# 压缩包中的每个表格在进程池中并行读取和校验（parse_import_sheet 必须是模块级函数才能传给子进程），
+# 主进程检查跨文件的学号冲突，然后与单文件导入一样对比已有数据，在同一个事务中写入。
+IMPORT_ZIP_MAX_FILES = 200
+IMPORT_ZIP_MAX_BYTES = 50 * 1024 * 1024   # 解压后的总大小上限
+IMPORT_SHEET_EXTENSIONS = {'.csv', '.xlsx'}
+IMPORT_REQUIRED_COLUMNS = ['学号', '姓名', '课程1成绩', '课程2成绩']
+import_pool = None
+import_pool_lock = threading.Lock()
+
+
+def get_import_pool():
+    # 第一次 zip 导入时创建；使用 spawn 启动子进程，避免在多线程的 worker 中 fork
+    global import_pool
+    with import_pool_lock:
+        if import_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            import_pool = ProcessPoolExecutor(max_workers=app.config['IMPORT_WORKERS'],
+                                              mp_context=multiprocessing.get_context('spawn'))
+        return import_pool
+
+
+def read_zip_sheets(file):
+    sheets = []
+    total = 0
+    with zipfile.ZipFile(file) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            base = os.path.basename(name)
+            if info.is_dir() or name.startswith('__MACOSX/') or base.startswith(('.', '~$')):
+                continue
+            if os.path.splitext(base)[1].lower() not in IMPORT_SHEET_EXTENSIONS:
+                continue
+            total += info.file_size
+            if len(sheets) >= IMPORT_ZIP_MAX_FILES or total > IMPORT_ZIP_MAX_BYTES:
+                raise ValueError(f'压缩包中的文件过多或过大（最多{IMPORT_ZIP_MAX_FILES}个文件，'
+                                 f'解压后不超过{IMPORT_ZIP_MAX_BYTES // 1024 // 1024}MB）')
+            sheets.append((name, archive.read(info)))
+    if not sheets:
+        raise ValueError('压缩包中没有CSV或Excel(xlsx)文件')
+    return sheets
+
+
+def parse_import_sheet(name, data):
+    # 在子进程中运行：返回 (文件名, 行数, 有效行, 错误列表)，有效行带行号
+    def file_error(message):
+        return name, 0, None, [{'source': name, 'line': 0, 'error': message[:200],
+                                'sno': '', 'name': '', 'score1': '', 'score2': ''}]
+
+    try:
+        df = read_import_file(io.BytesIO(data), os.path.splitext(name)[1].lower())
+    except Exception as e:
+        return file_error(f'读取文件失败：{e}')
+    missing = [col for col in IMPORT_REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        return file_error(f'文件缺少以下必需列：{", ".join(missing)}')
+    if '班级' not in df.columns:
+        # 每个班级一个文件：没有班级列时以文件名（不含扩展名）作为班级
+        df['班级'] = os.path.splitext(os.path.basename(name))[0]
+    valid, error_rows = validate_import(df)
+    for error in error_rows:
+        error['source'] = name
+    valid = valid.assign(source=name, line=valid.index + 2)
+    return name, len(df), valid, error_rows
+
+
+def find_sno_conflicts(valid):
+    # 同一学号出现在多个文件中：每个涉及的行都记为错误
+    duplicated = valid[valid.duplicated('sno', keep=False)]
+    sources = duplicated.groupby('sno')['source'].transform('nunique')
+    conflicts = duplicated[sources > 1]
+    return [{'source': r.source, 'line': int(r.line), 'error': '学号在多个文件中重复',
+             'sno': r.sno, 'name': r.name, 'score1': import_cell(r.score1), 'score2': import_cell(r.score2)}
+            for r in conflicts.itertuples(index=False)]
+
+
+def import_files_table(files):
+    rows = ''.join(f"""
+        <tr>
+            <td>{xml_escape(name)}</td>
+            <td>{f['rows']}</td>
+            <td>{f['insert']}</td>
+            <td>{f['update']}</td>
+            <td>{f['unchanged']}</td>
+        </tr>
+        """ for name, f in files.items())
+    return f"""
+    <div class="card">
+        <div class="card-body">
+            <h5 class="card-title">各文件明细</h5>
+            <table class="table table-sm table-striped">
+                <thead class="thead-dark">
+                    <tr>
+                        <th>文件</th>
+                        <th>行数</th>
+                        <th>新增</th>
+                        <th>更新</th>
+                        <th>没有变化</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {rows}
+                </tbody>
+            </table>
+        </div>
+    </div>
+    """
+
+
+def import_zip(file, dry_run, exam_date=None):
+    import pandas as pd
+    from concurrent.futures.process import BrokenProcessPool
+
+    global import_pool
+    sheets = read_zip_sheets(file)
+    if len(sheets) == 1:
+        results = [parse_import_sheet(*sheets[0])]
+    else:
+        pool = get_import_pool()
+        try:
+            results = list(pool.map(parse_import_sheet, *zip(*sheets)))
+        except BrokenProcessPool:
+            with import_pool_lock:
+                import_pool = None
+            raise ValueError('解析进程异常退出，请重试')
+
+    total_rows = sum(rows for _, rows, _, _ in results)
+    error_rows = [error for _, _, _, errors in results for error in errors]
+    frames = [valid for _, _, valid, _ in results if valid is not None]
+    valid = pd.concat(frames, ignore_index=True) if frames else None
+    if valid is not None:
+        error_rows += find_sno_conflicts(valid)
+    if error_rows:
+        db.session.rollback()
+        report_id = save_import_report(file.filename, total_rows, error_rows)
+        session['import_report'] = report_id
+        flash(f'导入失败：{len(error_rows)}行数据有误，未导入任何数据，请查看错误报告。', 'danger')
+        return redirect(url_for('import_report', report_id=report_id))
+
+    diff = diff_import(valid)
+    summary = import_summary(diff, total_rows)
+    unchanged = ~diff['is_new'] & ~diff['changed']
+    counts = pd.DataFrame({'source': diff['source'], 'insert': diff['is_new'],
+                           'update': diff['changed'], 'unchanged': unchanged}).groupby('source').sum()
+    files = {}
+    for name, rows, _, _ in results:
+        c = counts.loc[name] if name in counts.index else {'insert': 0, 'update': 0, 'unchanged': 0}
+        files[name] = {'rows': rows, 'insert': int(c['insert']), 'update': int(c['update']),
+                       'unchanged': int(c['unchanged'])}
+    if not dry_run:
+        write_import(diff, exam_date)
+        db.session.commit()
+    return import_preview_page(file.filename, summary, files, applied=not dry_run)
+
+
+IMPORT_FIELD_LABELS = {'name': '姓名', 'score1': '课程1成绩', 'score2': '课程2成绩', 'school': '学校', 'class_name': '班级'}
+
+
+def import_preview_page(filename, summary, files=None, applied=False):
+    # applied：zip 导入已经写入数据库，页面作为逐个文件的导入结果
+    fields = '，'.join(f'{IMPORT_FIELD_LABELS[field]} {count} 条'
+                      for field, count in summary['fields'].items() if count) or '无'
+    rows = ''.join(f"""
+        <tr>
+            <td>{xml_escape(sno)}</td>
+            <td>{'<br>'.join(f'{IMPORT_FIELD_LABELS[field]}：{xml_escape(str(old))} → {xml_escape(str(new))}'
+                             for field, (old, new) in changes.items())}</td>
+        </tr>
+        """ for sno, changes in summary['samples'])
+    more = (f'<p class="text-muted">仅列出前 {len(summary["samples"])} 条修改。</p>'
+            if summary['update'] > len(summary['samples']) else '')
+    return f"""
+    {html_header("导入结果" if applied else "导入预览")}
+    <div class="card">
+        <div class="card-body">
+            <h5 class="card-title">{xml_escape(filename)}</h5>
+            <ul class="list-group mb-3">
+                <li class="list-group-item"><strong>文件行数：</strong> {summary['total']}</li>
+                <li class="list-group-item"><strong>新增学生：</strong> {summary['insert']}</li>
+                <li class="list-group-item"><strong>更新学生：</strong> {summary['update']}（{fields}）</li>
+                <li class="list-group-item"><strong>没有变化（将跳过）：</strong> {summary['unchanged']}</li>
+            </ul>
+            {'<p class="text-success">以上修改已在同一个事务中写入数据库。</p>' if applied else
+             '<p class="text-muted">预览没有写入数据库。确认无误后请取消勾选“仅预览”重新上传该文件。</p>'}
+            <a href="/import_export" class="btn btn-primary btn-sm">返回导入页面</a>
+        </div>
+    </div>
+    {import_files_table(files) if files else ''}
+    <div class="card">
+        <div class="card-body">
+            <h5 class="card-title">修改明细</h5>
+            {more}
+            <table class="table table-sm table-striped">
+                <thead class="thead-dark">
+                    <tr>
+                        <th>学号</th>
+                        <th>修改内容</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {rows or '<tr><td colspan="2" class="text-center text-muted">没有需要更新的学生</td></tr>'}
+                </tbody>
+            </table>
+        </div>
+    </div>
+    {html_footer()}
+    """
+
+
 @app.route('/import_export', methods=['GET', 'POST'])
+@login_required
 def import_export():
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
-
     # 获取当前时间和用户
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     current_user = session.get('username', 'Anonymous')
     import_error = None
+    report_id = session.get('import_report')
+    last_report = db.session.get(ImportReport, report_id) if report_id else None
 
     if request.method == 'POST':
         if 'file' not in request.files:
@@ -930,48 +2906,23 @@ def import_export():
         file.seek(0)  # 重置文件指针
 
         # 检查文件扩展名
-        allowed_extensions = {'.csv', '.xlsx'}
         file_ext = os.path.splitext(file.filename)[1].lower()
 
-        if file_ext not in allowed_extensions:
-            flash('请上传CSV或Excel(xlsx)格式的文件！', 'danger')
-            import_error = "导入错误：文件格式不正确，仅支持CSV和Excel(xlsx)格式"
+        if file_ext not in IMPORT_EXTENSIONS:
+            flash('请上传CSV、Excel(xlsx)、Parquet、Arrow格式的文件或zip压缩包！', 'danger')
+            import_error = "导入错误：文件格式不正确，仅支持CSV、Excel(xlsx)、Parquet、Arrow格式和zip压缩包"
             return redirect(request.url)
 
         try:
-            # 根据文件类型读取数据
-            if file_ext == '.csv':
-                # 尝试不同的编码方式和分隔符
-                try:
-                    # 读取CSV文件
-                    df = pd.read_csv(file, encoding='utf-8-sig')  # 使用 utf-8-sig 来自动处理 BOM
-
-                    # 确保列名正确（移除可能的BOM标记）
-                    df.columns = df.columns.str.replace('\ufeff', '')
-
-                    print("读取到的数据：")
-                    print(df.head())
-                    print(f"处理后的列名：{df.columns.tolist()}")
+            exam_date = parse_exam_date(request.form.get('exam_date')) if request.form.get('exam_date') else None
+        except ValueError:
+            flash('考试日期格式不正确！', 'danger')
+            return redirect(request.url)
 
-                except Exception as e:
-                    # 如果上面的方法失败，尝试其他编码
-                    try:
-                        file.seek(0)
-                        df = pd.read_csv(file, encoding='gbk')
-                        df.columns = df.columns.str.replace('\ufeff', '')
-                    except Exception:
-                        try:
-                            file.seek(0)
-                            df = pd.read_csv(file, encoding='gb2312')
-                            df.columns = df.columns.str.replace('\ufeff', '')
-                        except Exception:
-                            raise ValueError("无法正确读取CSV文件，请检查文件格式和编码")
-            else:  # .xlsx
-                df = pd.read_excel(file)
-
-            print("最终读取到的数据：")
-            print(df.head())
-            print(f"列名：{df.columns.tolist()}")
+        try:
+            if file_ext == '.zip':
+                return import_zip(file, request.form.get('dry_run') == '1', exam_date)
+            df = read_import_file(file, file_ext)
 
             # 验证必要的列是否存在
             required_columns = ['学号', '姓名', '课程1成绩', '课程2成绩']
@@ -979,7 +2930,7 @@ def import_export():
 
             if missing_cols:
                 error_msg = f'文件格式错误！文件缺少以下必需列：{", ".join(missing_cols)}\n'
-                error_msg += f'当前文件的列名：{", ".join(df.columns.tolist())}\n'
+                error_msg += f'当前文件的列名：{", ".join(map(str, df.columns.tolist()))}\n'
                 error_msg += '请确保文件第一行包含以下列名：学号、姓名、课程1成绩、课程2成绩'
                 flash(error_msg, 'danger')
                 import_error = error_msg
@@ -991,60 +2942,25 @@ def import_export():
                 return redirect(request.url)
 
             # 数据验证
-            error_rows = []
-            success_count = 0
-
-            for index, row in df.iterrows():
-                try:
-                    # 验证数据格式
-                    sno = str(row['学号']).strip()
-                    name = str(row['姓名']).strip()
-
-                    try:
-                        score1 = float(row['课程1成绩'])
-                        score2 = float(row['课程2成绩'])
-                    except ValueError:
-                        raise ValueError("成绩必须为数字")
-
-                    # 验证数据有效性
-                    if not sno or not name:
-                        raise ValueError("学号或姓名不能为空")
-                    if not (0 <= score1 <= 100) or not (0 <= score2 <= 100):
-                        raise ValueError("成绩必须在0-100之间")
-
-                    # 检查学号是否已存在
-                    existing_student = Student.query.filter_by(sno=sno).first()
-                    if existing_student:
-                        # 更新现有记录
-                        existing_student.name = name
-                        existing_student.score1 = score1
-                        existing_student.score2 = score2
-                    else:
-                        # 创建新记录
-                        student = Student(
-                            sno=sno,
-                            name=name,
-                            score1=score1,
-                            score2=score2
-                        )
-                        db.session.add(student)
-
-                    success_count += 1
-                except Exception as e:
-                    error_msg = f"第{index + 2}行: {str(e)}"
-                    error_rows.append(error_msg)
+            dry_run = request.form.get('dry_run') == '1'
+            summary, error_rows = import_students(df, dry_run=dry_run, exam_date=exam_date)
 
             if error_rows:
-                # 如果有错误，回滚事务
+                # 如果有错误，回滚事务；错误明细保存为服务器端报告，会话中只放报告ID
+                db.session.rollback()
+                report_id = save_import_report(file.filename, len(df), error_rows)
+                session['import_report'] = report_id
+                flash(f'导入失败：{len(error_rows)}行数据有误，未导入任何数据，请查看错误报告。', 'danger')
+                return redirect(url_for('import_report', report_id=report_id))
+            elif dry_run:
                 db.session.rollback()
-                error_message = "导入过程中发现以下错误：\n" + "\n".join(error_rows)
-                flash(error_message, 'danger')
-                import_error = error_message
+                return import_preview_page(file.filename, summary)
             else:
                 try:
-                    # 提交事务
+                    # 提交事务；没有变化的学生已跳过，重复上传同一份名单不会写数据库
                     db.session.commit()
-                    flash(f'成功导入{success_count}条数据！', 'success')
+                    flash(f"导入完成：新增{summary['insert']}条，更新{summary['update']}条，"
+                          f"{summary['unchanged']}条没有变化已跳过。", 'success')
                     return redirect(url_for('list_students'))
                 except Exception as e:
                     db.session.rollback()
@@ -1053,6 +2969,7 @@ def import_export():
                     import_error = error_message
 
         except Exception as e:
+            db.session.rollback()
             error_message = f'读取文件失败：{str(e)}'
             flash(error_message, 'danger')
             import_error = error_message
@@ -1070,17 +2987,29 @@ def import_export():
                     </div>
                     <div class="card-body">
                         {f'<div class="alert alert-danger">{import_error}</div>' if import_error else ''}
+                        {f'<div class="alert alert-warning">上次导入（{xml_escape(last_report.filename)}）有 {last_report.error_count} 行错误，<a href="/import_report/{last_report.id}">查看错误报告</a></div>' if last_report else ''}
                         <form method="post" enctype="multipart/form-data" class="needs-validation" novalidate>
                             <div class="mb-3">
                                 <label class="form-label">选择文件</label>
-                                <input type="file" class="form-control" name="file" accept=".csv,.xlsx" required>
+                                <input type="file" class="form-control" name="file" accept=".csv,.xlsx,.parquet,.arrow,.arrows,.feather,.zip" required>
                                 <div class="invalid-feedback">
                                     请选择一个文件
                                 </div>
                                 <small class="form-text text-muted">
-                                    支持CSV和Excel(xlsx)格式文件（文件大小限制5MB）
+                                    支持CSV、Excel(xlsx)、Parquet和Arrow格式文件，也可以把各班的表格打包成zip一次上传（文件大小限制5MB）
                                 </small>
                             </div>
+                            <div class="mb-3">
+                                <label class="form-label">考试日期（可选）</label>
+                                <input type="date" class="form-control" name="exam_date">
+                                <small class="form-text text-muted">
+                                    填写后文件中所有学生的成绩都记为这次考试；不填时只把新增和成绩有变化的学生记入今天的成绩历史
+                                </small>
+                            </div>
+                            <div class="form-check mb-3">
+                                <input type="checkbox" class="form-check-input" name="dry_run" value="1" id="dry_run">
+                                <label class="form-check-label" for="dry_run">仅预览（显示将新增、更新的学生，不写入数据库）</label>
+                            </div>
                             <button type="submit" class="btn btn-primary">
                                 <i class="fas fa-file-import"></i> 导入
                             </button>
@@ -1100,9 +3029,18 @@ def import_export():
                             <a href="/export_csv" class="btn btn-success">
                                 <i class="fas fa-file-export"></i> 导出为CSV
                             </a>
+                            <a href="/export_xlsx" class="btn btn-primary">
+                                <i class="fas fa-file-excel"></i> 导出为Excel
+                            </a>
                             <a href="/export_pdf" class="btn btn-danger">
                                 <i class="fas fa-file-pdf"></i> 导出为PDF
                             </a>
+                            <a href="/export_parquet" class="btn btn-secondary">
+                                <i class="fas fa-file-export"></i> 导出为Parquet
+                            </a>
+                            <a href="/export_arrow" class="btn btn-secondary">
+                                <i class="fas fa-file-export"></i> 导出为Arrow
+                            </a>
                         </div>
                     </div>
                 </div>
@@ -1121,15 +3059,18 @@ def import_export():
                 </div>
                 <h6>文件要求：</h6>
                 <ul>
-                    <li>支持的文件格式：CSV和Excel(xlsx)</li>
-                    <li>文件必须包含以下列：学号、姓名、课程1成绩、课程2成绩</li>
+                    <li>支持的文件格式：CSV、Excel(xlsx)、Parquet和Arrow</li>
+                    <li>文件必须包含以下列：学号、姓名、课程1成绩、课程2成绩（Parquet/Arrow 文件也可以使用导出时的 sno、name、score1、score2）</li>
+                    <li>可选列：学校、班级；有这两列时同时更新学生所在的学校和班级</li>
                     <li>成绩必须为0-100之间的数字</li>
                     <li>学号和姓名不能为空</li>
                     <li>文件大小不能超过5MB</li>
+                    <li>zip 压缩包中的各个文件并行解析；同一学号出现在多个文件中时整包不导入，错误报告中列出冲突的行</li>
+                    <li>zip 中没有班级列的文件，以文件名（不含扩展名）作为班级</li>
                 </ul>
                 <h6>注意事项：</h6>
                 <ul>
-                    <li>如果导入的学号已存在，将更新该学生的信息</li>
+                    <li>如果导入的学号已存在，将更新该学生的信息；姓名和成绩都没有变化的行会被跳过</li>
                     <li>建议先导出一份CSV文件作为模板参考</li>
                 </ul>
             </div>
@@ -1138,66 +3079,384 @@ def import_export():
     {html_footer()}
     """
 
-# 导出CSV
-@app.route('/export_csv')
-def export_csv():
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
-
-    students = Student.query.all()
+# 导入错误报告
+# 最多保存 IMPORT_ERROR_LIMIT 行错误明细（按错误类型的计数包含全部错误），超过 IMPORT_REPORT_MAX_AGE 秒的报告自动删除
+IMPORT_REPORT_PAGE_SIZE = 100
+IMPORT_REPORT_HEADERS = ['文件', '行号', '错误', '学号', '姓名', '课程1成绩', '课程2成绩']
+
+
+def save_import_report(filename, total_rows, error_rows):
+    counts = {}
+    for error in error_rows:
+        counts[error['error']] = counts.get(error['error'], 0) + 1
+    report_id = secrets.token_urlsafe(8)[:11]
+    expired = datetime.now() - timedelta(seconds=app.config['IMPORT_REPORT_MAX_AGE'])
+    expired_ids = db.select(ImportReport.id).where(ImportReport.created_at < expired)
+    db.session.execute(ImportErrorRow.__table__.delete().where(ImportErrorRow.report_id.in_(expired_ids)))
+    db.session.execute(ImportReport.__table__.delete().where(ImportReport.created_at < expired))
+    db.session.execute(ImportReport.__table__.insert().values(
+        id=report_id, username=session.get('username', 'system'), filename=filename[:255],
+        total_rows=total_rows, error_count=len(error_rows),
+        error_types=json.dumps(counts, ensure_ascii=False), created_at=datetime.now()))
+    rows = [dict(error, report_id=report_id, source=error.get('source'))
+            for error in error_rows[:app.config['IMPORT_ERROR_LIMIT']]]
+    for i in range(0, len(rows), 1000):
+        db.session.execute(ImportErrorRow.__table__.insert(), rows[i:i + 1000])
+    db.session.commit()
+    return report_id
+
+
+def get_import_report(report_id):
+    # 只有上传者本人和管理员可以查看
+    report = db.session.get(ImportReport, report_id)
+    if report is None:
+        return None
+    user = current_user()
+    if report.username != user['username'] and user['role'] != 'admin':
+        return None
+    return report
+
+
+@app.route('/import_report/<report_id>')
+@login_required
+def import_report(report_id):
+    report = get_import_report(report_id)
+    if report is None:
+        flash('错误报告不存在或已过期！', 'danger')
+        return redirect(url_for('import_export'))
+    page = max(request.args.get('page', 1, type=int), 1)
+    stored = min(report.error_count, app.config['IMPORT_ERROR_LIMIT'])
+    pages = max((stored + IMPORT_REPORT_PAGE_SIZE - 1) // IMPORT_REPORT_PAGE_SIZE, 1)
+    errors = db.session.execute(
+        db.select(ImportErrorRow).where(ImportErrorRow.report_id == report_id)
+        .order_by(ImportErrorRow.source, ImportErrorRow.line)
+        .offset((page - 1) * IMPORT_REPORT_PAGE_SIZE).limit(IMPORT_REPORT_PAGE_SIZE)).scalars().all()
+
+    type_rows = ''.join(f"""
+        <tr>
+            <td>{xml_escape(error)}</td>
+            <td>{count}</td>
+        </tr>
+        """ for error, count in sorted(json.loads(report.error_types).items(), key=lambda item: -item[1]))
+    rows = ''.join(f"""
+        <tr>
+            <td>{xml_escape(e.source or '')}</td>
+            <td>{e.line}</td>
+            <td>{xml_escape(e.error)}</td>
+            <td>{xml_escape(e.sno or '')}</td>
+            <td>{xml_escape(e.name or '')}</td>
+            <td>{xml_escape(e.score1 or '')}</td>
+            <td>{xml_escape(e.score2 or '')}</td>
+        </tr>
+        """ for e in errors)
+    pager = ''
+    if page > 1:
+        pager += f'<a href="?page={page - 1}" class="btn btn-outline-secondary btn-sm">上一页</a> '
+    if page < pages:
+        pager += f'<a href="?page={page + 1}" class="btn btn-outline-primary btn-sm">下一页</a>'
+    truncated = (f'<p class="text-muted">仅保存了前 {stored} 行错误明细。</p>'
+                 if report.error_count > stored else '')
 
-    # 创建一个StringIO对象来写入CSV数据
-    output = io.StringIO()
-    output.write('\ufeff')  # 添加BOM标记，解决Excel打开中文乱码问题
+    return f"""
+    {html_header("导入错误报告")}
+    <div class="card">
+        <div class="card-body">
+            <h5 class="card-title">{xml_escape(report.filename)}</h5>
+            <p>导入时间：{report.created_at.strftime('%Y-%m-%d %H:%M:%S')}，共 {report.total_rows} 行，其中 {report.error_count} 行有错误，未导入任何数据。行号为 0 的错误表示整个文件无法读取。</p>
+            <table class="table table-sm">
+                <thead>
+                    <tr>
+                        <th>错误类型</th>
+                        <th>行数</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {type_rows}
+                </tbody>
+            </table>
+            <a href="/import_report/{report.id}/download" class="btn btn-success btn-sm">
+                <i class="fas fa-file-csv"></i> 下载错误行（CSV）
+            </a>
+            <a href="/import_export" class="btn btn-secondary btn-sm">返回导入页面</a>
+        </div>
+    </div>
+    <div class="card">
+        <div class="card-body">
+            <h5 class="card-title">错误明细（第 {page}/{pages} 页）</h5>
+            {truncated}
+            <div class="table-responsive">
+                <table class="table table-sm table-striped">
+                    <thead class="thead-dark">
+                        <tr>
+                            {''.join(f'<th>{h}</th>' for h in IMPORT_REPORT_HEADERS)}
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {rows}
+                    </tbody>
+                </table>
+            </div>
+            {pager}
+        </div>
+    </div>
+    {html_footer()}
+    """
 
-    # 写入表头
-    headers = ['学号', '姓名', '课程1成绩', '课程2成绩', '总成绩', '录入时间']
-    output.write(','.join(headers) + '\n')
 
-    # 写入数据
-    for student in students:
-        total = student.score1 + student.score2
-        created_time = student.created_at.strftime('%Y-%m-%d %H:%M:%S') if student.created_at else ''
-        row = [
-            str(student.sno),
-            student.name,
-            str(student.score1),
-            str(student.score2),
-            str(total),
-            created_time
-        ]
-        output.write(','.join(row) + '\n')
-
-    # 生成响应
-    output.seek(0)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    return Response(
-        output.getvalue().encode('utf-8-sig'),
-        mimetype='text/csv',
-        headers={
-            "Content-Disposition": f"attachment; filename=student_scores_{timestamp}.csv",
-            "Content-Type": "text/csv; charset=utf-8-sig"
-        }
+@app.route('/import_report/<report_id>/download')
+@login_required
+def download_import_report(report_id):
+    report = get_import_report(report_id)
+    if report is None:
+        flash('错误报告不存在或已过期！', 'danger')
+        return redirect(url_for('import_export'))
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM，Excel 打开时不乱码
+        writer.writerow(IMPORT_REPORT_HEADERS)
+        result = db.session.execute(
+            db.select(ImportErrorRow.source, ImportErrorRow.line, ImportErrorRow.error, ImportErrorRow.sno,
+                      ImportErrorRow.name, ImportErrorRow.score1, ImportErrorRow.score2)
+            .where(ImportErrorRow.report_id == report_id).order_by(ImportErrorRow.source, ImportErrorRow.line)
+            .execution_options(yield_per=1000))
+        for partition in result.partitions():
+            writer.writerows(partition)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=import_errors_{report_id}.csv'})
+
+
+# 后台导出任务
+# 导出文件按“数据版本 + 格式”缓存在 EXPORT_DIR 中：数据没有变化时直接返回已生成的文件，
+# 否则提交到后台线程池生成，页面自动刷新直到文件就绪。旧文件按时间和总大小淘汰。
+# 只导出一个学校或班级时，版本只取决于该分区，其他分区的修改不会让已生成的文件失效。
+
+export_executor = ThreadPoolExecutor(max_workers=app.config['EXPORT_WORKERS'], thread_name_prefix='export')
+export_jobs = OrderedDict()
+export_jobs_lock = threading.Lock()
+MAX_TRACKED_JOBS = 200
+
+
+def data_version(engine=None):
+    # 学生数、最后修改时间和最后一条删除记录共同决定数据版本，一次查询即可得到；
+    # 版本默认从主库计算，独立的只读副本落后时不会得到旧版本（见 replica_has_version）
+    student_table = Student.__table__
+    log_table = StudentChangeLog.__table__
+    query = db.select(
+        db.func.count(student_table.c.id),
+        db.func.max(student_table.c.updated_at),
+        db.select(db.func.max(log_table.c.id)).scalar_subquery(),
+    )
+    with (engine or db.engines[None]).connect() as conn:
+        count, last_update, last_delete = conn.execute(query).one()
+    return hashlib.sha1(f'{count}|{last_update}|{last_delete}'.encode()).hexdigest()[:12]
+
+
+def backup_version():
+    # 备份还要包含用户和课程：这两个表很小，直接取全部内容参与计算，改密码、改角色也会触发新的备份
+    user_table, course_table = User.__table__, Course.__table__
+    query = db.union_all(
+        db.select(db.literal('user'), user_table.c.id, user_table.c.username,
+                  user_table.c.password, user_table.c.role),
+        db.select(db.literal('course'), course_table.c.id, course_table.c.name,
+                  db.cast(course_table.c.credit, db.String), db.literal('')),
     )
+    with db.engines[None].connect() as conn:
+        rows = sorted(tuple(row) for row in conn.execute(query))
+    return hashlib.sha1(f'{data_version()}|{rows}'.encode()).hexdigest()[:12]
+
+
+def export_version(partition, engine=None):
+    if partition == NO_PARTITION:
+        return data_version(engine)
+    query = partition_where(db.select(db.func.count(Student.id), db.func.max(Student.updated_at)), partition)
+    with (engine or db.engines[None]).connect() as conn:
+        count, last_update = conn.execute(query).one()
+    return hashlib.sha1(f'{partition}|{count}|{last_update}'.encode()).hexdigest()[:12]
+
+
+def replica_has_version(version, partition=NO_PARTITION):
+    # 文件按主库的数据版本命名。只读路由提交的任务读取副本，副本（独立的只读库）还没有同步到这个版本时，
+    # 改为从主库生成，避免把旧数据保存在新版本的文件名下
+    if not g.get('read_only') or replica_mode() == 'pool':
+        return True
+    return export_version(partition, db.engines['read']) == version
+
+
+def submit_job(key, func, retry=False):
+    # 同一个 key 的任务只会运行一次，重复点击共享同一个任务；失败的任务只有明确重试时才重新提交。
+    # 从只读路由提交的任务同样走只读连接池
+    read_only = bool(has_request_context() and g.get('read_only'))
+    with export_jobs_lock:
+        job = export_jobs.get(key)
+        if job is None or (retry and job['status'] == 'failed'):
+            job = {'key': key, 'status': 'running', 'result': None, 'error': None,
+                   'started': datetime.now()}
+            export_jobs[key] = job
+            while len(export_jobs) > MAX_TRACKED_JOBS:
+                export_jobs.popitem(last=False)
+            export_executor.submit(run_job, job, func, read_only)
+    return job
+
+
+def run_job(job, func, read_only=False):
+    try:
+        with app.app_context():
+            g.read_only = read_only
+            job['result'] = func()
+        job['status'] = 'done'
+    except Exception as e:
+        app.logger.exception(f"后台任务失败：{job['key']}")
+        job['error'] = str(e)
+        job['status'] = 'failed'
+
+
+def artifact_path(kind, version):
+    ext = EXPORT_BUILDERS[kind]['ext']
+    return os.path.join(app.config['EXPORT_DIR'], f'{kind}_{version}.{ext}')
+
+
+def build_artifact(kind, version, partition=NO_PARTITION):
+    os.makedirs(app.config['EXPORT_DIR'], exist_ok=True)
+    path = artifact_path(kind, version)
+    # 临时文件名在所有 worker 进程和线程之间唯一
+    fd, tmp_path = tempfile.mkstemp(dir=app.config['EXPORT_DIR'], prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        EXPORT_BUILDERS[kind]['build'](tmp_path, partition)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    evict_artifacts(keep=path)
+    return path
+
+
+def remove_artifact(path):
+    # 先丢弃生成该文件的已完成任务，再删除文件：之后的请求会重新提交任务，而不是发送一个不存在的文件
+    with export_jobs_lock:
+        for key in [key for key, job in export_jobs.items() if job['result'] == path]:
+            del export_jobs[key]
+    os.remove(path)
+
+
+def evict_artifacts(keep=None):
+    export_dir = app.config['EXPORT_DIR']
+    now = time.time()
+    files = []
+    for filename in os.listdir(export_dir):
+        path = os.path.join(export_dir, filename)
+        if filename.endswith('.tmp') or path == keep:
+            continue
+        stat = os.stat(path)
+        if now - stat.st_mtime > app.config['EXPORT_MAX_AGE']:
+            remove_artifact(path)
+        else:
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= app.config['EXPORT_MAX_BYTES']:
+            break
+        remove_artifact(path)
+        total -= size
+
+
+def job_pending_page(title, job):
+    if job['status'] == 'failed':
+        return f"""
+        {html_header(title)}
+        <div class="alert alert-danger">生成失败：{job['error']}</div>
+        <a href="{request.path}?{urlencode(dict(request.args, retry=1))}" class="btn btn-primary">重试</a>
+        {html_footer()}
+        """
+    return f"""
+    {html_header(title)}
+    <meta http-equiv="refresh" content="2">
+    <div class="alert alert-info">
+        <i class="fas fa-spinner fa-spin"></i> 正在后台处理，页面会自动刷新……
+    </div>
+    {html_footer()}
+    """
 
-# 导出PDF
-@app.route('/export_pdf')
-def export_pdf():
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
 
-    students = Student.query.all()
+def serve_export(kind, download_name, partition=NO_PARTITION):
+    # 已有当前数据版本的文件时立即返回，否则提交后台任务
+    version = export_version(partition)
+    path = artifact_path(kind, version)
+    if os.path.exists(path):
+        try:
+            return send_file(path, mimetype=EXPORT_BUILDERS[kind]['mimetype'],
+                             as_attachment=True, download_name=download_name)
+        except FileNotFoundError:
+            pass    # 检查之后刚好被淘汰，重新生成
+    if not replica_has_version(version, partition):
+        g.read_only = False
+    job = submit_job(f'{kind}_{version}', lambda: build_artifact(kind, version, partition),
+                     retry=bool(request.args.get('retry')))
+    if job['status'] != 'done':
+        return job_pending_page('导出数据', job)
+    return send_file(path, mimetype=EXPORT_BUILDERS[kind]['mimetype'],
+                     as_attachment=True, download_name=download_name)
+
+
+def build_csv(path, partition=NO_PARTITION):
+    students = partition_where(Student.query, partition).all()
+
+    with open(path, 'w', encoding='utf-8-sig', newline='') as output:  # utf-8-sig 添加BOM标记，解决Excel打开中文乱码问题
+        # 写入表头
+        headers = ['学号', '姓名', '课程1成绩', '课程2成绩', '总成绩', '录入时间', '学校', '班级']
+        output.write(','.join(headers) + '\n')
+
+        # 写入数据
+        for student in students:
+            total = student.score1 + student.score2
+            created_time = student.created_at.strftime('%Y-%m-%d %H:%M:%S') if student.created_at else ''
+            row = [
+                str(student.sno),
+                student.name,
+                str(student.score1),
+                str(student.score2),
+                str(total),
+                created_time,
+                student.school,
+                student.class_name
+            ]
+            output.write(','.join(row) + '\n')
+
+
+def register_pdf_font():
+    # 字体只注册一次；预加载时在主进程中注册，worker 直接共享
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    if 'SimSun' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('SimSun', 'simsun.ttc'))
+
+
+def build_pdf(path, partition=NO_PARTITION):
+    # reportlab 只在导出PDF时加载
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    students = partition_where(Student.query, partition).all()
 
     # 创建PDF
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
+    p = canvas.Canvas(path, pagesize=letter)
 
     # 设置中文字体
-    pdfmetrics.registerFont(TTFont('SimSun', 'simsun.ttc'))
+    register_pdf_font()
     p.setFont('SimSun', 12)
 
     # 添加标题
     p.drawString(250, 750, "学生成绩表")
+    if partition != NO_PARTITION:
+        p.drawString(250, 730, partition_label(partition))
 
     # 添加表头
     headers = ['学号', '姓名', '课程1成绩', '课程2成绩', '总成绩']
@@ -1223,81 +3482,382 @@ def export_pdf():
 
     p.save()
 
-    buffer.seek(0)
+
+EXPORT_BUILDERS = {
+    'csv': {'ext': 'csv', 'mimetype': 'text/csv', 'build': build_csv},
+    'pdf': {'ext': 'pdf', 'mimetype': 'application/pdf', 'build': build_pdf},
+    'ranking_txt': {'ext': 'txt', 'mimetype': 'text/plain',
+                    'build': lambda path, partition: build_ranking_txt(path, partition)},
+    'ranking_csv': {'ext': 'csv', 'mimetype': 'text/csv',
+                    'build': lambda path, partition: build_ranking_csv(path, partition)},
+    'ranking_xlsx': {'ext': 'xlsx', 'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                     'build': lambda path, partition: build_ranking_xlsx(path, partition)},
+}
+
+
+# 导出CSV
+@app.route('/export_csv')
+@login_required
+@read_only_route
+def export_csv():
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return serve_export('csv', f'student_scores_{timestamp}.csv', current_partition())
+
+# 导出PDF
+@app.route('/export_pdf')
+@login_required
+@read_only_route
+def export_pdf():
+    return serve_export('pdf', 'student_scores.pdf', current_partition())
+
+# 导出Parquet / Arrow
+# 按批次从数据库读取，每批转换成一个 RecordBatch 写出，边生成边发送给客户端
+COLUMNAR_BATCH_SIZE = 10000
+
+
+class StreamSink(io.RawIOBase):
+    # pyarrow 写入的字节先暂存在这里，由生成器取走发送
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def student_arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('sno', pa.string()),
+        ('name', pa.string()),
+        ('score1', pa.float64()),
+        ('score2', pa.float64()),
+        ('total', pa.float64()),
+        ('created_at', pa.timestamp('us')),
+        ('updated_at', pa.timestamp('us')),
+        ('school', pa.string()),
+        ('class_name', pa.string()),
+    ])
+
+
+def student_record_batches(schema, partition=NO_PARTITION):
+    import pyarrow as pa
+
+    query = partition_where(db.select(Student.sno, Student.name, Student.score1, Student.score2,
+                                      Student.score1 + Student.score2, Student.created_at, Student.updated_at,
+                                      Student.school, Student.class_name), partition)
+    result = db.session.execute(query.execution_options(yield_per=COLUMNAR_BATCH_SIZE))
+    for rows in result.partitions():
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema)
+
+
+def stream_columnar(fmt, partition=NO_PARTITION):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = student_arrow_schema()
+    sink = StreamSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    for batch in student_record_batches(schema, partition):
+        writer.write_batch(batch)
+        yield sink.pop()
+    writer.close()
+    yield sink.pop()
+
+
+COLUMNAR_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def export_columnar(fmt):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        flash('服务器未安装 pyarrow，无法导出 Parquet/Arrow 文件！', 'danger')
+        return redirect(url_for('import_export'))
+
+    mimetype, ext = COLUMNAR_FORMATS[fmt]
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     return Response(
-        buffer.getvalue(),
-        mimetype='application/pdf',
-        headers={
-            'Content-Disposition': 'attachment; filename=student_scores.pdf',
-            'Content-Type': 'application/pdf'
-        }
+        stream_with_context(stream_columnar(fmt, current_partition())),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=student_scores_{timestamp}.{ext}"}
     )
 
-@app.route('/sort_save')
-def sort_save():
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
 
-    students = Student.query.all()
-    # 按总分排序（由高到低）
-    sorted_students = sorted(students, key=lambda x: (x.score1 + x.score2), reverse=True)
+@app.route('/export_parquet')
+@login_required
+@read_only_route
+def export_parquet():
+    return export_columnar('parquet')
+
+
+@app.route('/export_arrow')
+@login_required
+@read_only_route
+def export_arrow():
+    return export_columnar('arrow')
+
+# 导出Excel
+# 直接按 xlsx 的 zip 结构流式写出：工作表 XML 边查询边压缩发送，内存占用与行数无关
+XLSX_BATCH_SIZE = 5000
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="学生成绩" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        value = value.strftime('%Y-%m-%d %H:%M:%S')
+    text = xml_escape(XML_INVALID_CHARS.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t>{text}</t></is></c>'
+
+
+def xlsx_row(values):
+    return ('<row>' + ''.join(xlsx_cell(v) for v in values) + '</row>').encode('utf-8')
+
+
+def stream_xlsx(headers, rows):
+    sink = StreamSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in XLSX_STATIC_PARTS.items():
+            zf.writestr(name, content)
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        b'<sheetData>')
+            sheet.write(xlsx_row(headers))
+            for count, row in enumerate(rows, 1):
+                sheet.write(xlsx_row(row))
+                if count % XLSX_BATCH_SIZE == 0:
+                    yield sink.pop()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.pop()
+
+
+def student_export_rows(partition=NO_PARTITION):
+    query = partition_where(db.select(Student.sno, Student.name, Student.score1, Student.score2,
+                                      Student.score1 + Student.score2, Student.created_at,
+                                      Student.school, Student.class_name), partition)
+    yield from db.session.execute(query.execution_options(yield_per=XLSX_BATCH_SIZE))
+
+
+@app.route('/export_xlsx')
+@login_required
+@read_only_route
+def export_xlsx():
+    headers = ['学号', '姓名', '课程1成绩', '课程2成绩', '总成绩', '录入时间', '学校', '班级']
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return Response(
+        stream_with_context(stream_xlsx(headers, student_export_rows(current_partition()))),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers={"Content-Disposition": f"attachment; filename=student_scores_{timestamp}.xlsx"}
+    )
 
-    # 计算各类比例
-    total = len(students)
-    if total == 0:
-        return f"{html_header('排序与统计')}<p>当前没有学生数据。</p>{html_footer()}"
+# 排序保存
+# 排名文件由后台任务生成（见“后台导出任务”），同一数据版本和格式只生成一次
+RANKING_HEADERS = ['排名', '学号', '姓名', '课程1', '课程2', '总分']
+RANKING_FORMATS = ('txt', 'csv', 'xlsx')
+RANKING_BATCH_SIZE = 5000
+RANKING_PAGE_SIZE = 100     # 排序页面每页显示的学生数，完整排名在下载的文件中
+FILE_BUFFER_SIZE = 1024 * 1024
 
-    fail_count = sum(1 for s in students if s.score1 < 60 or s.score2 < 60)
-    pass_count = total - fail_count
-    good_count = sum(1 for s in students if 150 <= (s.score1 + s.score2) < 170)
-    excellent_count = sum(1 for s in students if (s.score1 + s.score2) >= 170)
 
-    # 计算比例
-    fail_ratio = fail_count / total * 100
-    pass_ratio = pass_count / total * 100
-    good_ratio = good_count / total * 100
-    excellent_ratio = excellent_count / total * 100
+def ranking_rows(partition=NO_PARTITION, offset=0, limit=None):
+    # 按总分排序（由高到低），在数据库中排序并分批读取；offset/limit 用于页面分页，名次从 offset + 1 开始
+    total = Student.score1 + Student.score2
+    query = partition_where(db.select(Student.sno, Student.name, Student.score1, Student.score2, total), partition) \
+        .order_by(total.desc(), Student.id).offset(offset).limit(limit)
+    result = db.session.execute(query.execution_options(yield_per=RANKING_BATCH_SIZE))
+    for idx, row in enumerate(result, offset + 1):
+        yield (idx, *row)
 
-    # 保存到文件
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'student_scores_{timestamp}.txt'
 
-    with open(filename, 'w', encoding='utf-8') as f:
+def ranking_ratios(partition=NO_PARTITION):
+    # 计算各类比例
+    total = Student.score1 + Student.score2
+    count, fail_count, good_count, excellent_count = db.session.execute(partition_where(db.select(
+        db.func.count(Student.id),
+        db.func.sum(db.case((db.or_(Student.score1 < 60, Student.score2 < 60), 1), else_=0)),
+        db.func.sum(db.case((db.and_(total >= 150, total < 170), 1), else_=0)),
+        db.func.sum(db.case((total >= 170, 1), else_=0)),
+    ), partition)).one()
+    if not count:
+        return {'count': 0, 'fail': 0, 'pass': 0, 'good': 0, 'excellent': 0}
+    return {
+        'count': count,
+        'fail': (fail_count or 0) / count * 100,
+        'pass': (count - (fail_count or 0)) / count * 100,
+        'good': (good_count or 0) / count * 100,
+        'excellent': (excellent_count or 0) / count * 100,
+    }
+
+
+def build_ranking_txt(path, partition=NO_PARTITION):
+    ratios = ranking_ratios(partition)
+
+    # 大缓冲区写入，避免逐行的小写操作
+    with open(path, 'w', encoding='utf-8', buffering=FILE_BUFFER_SIZE) as f:
         f.write("学生成绩排名表\n")
+        if partition != NO_PARTITION:
+            f.write(partition_label(partition) + "\n")
         f.write("=" * 50 + "\n")
         f.write("排名\t学号\t姓名\t课程1\t课程2\t总分\n")
         f.write("-" * 50 + "\n")
 
-        for idx, student in enumerate(sorted_students, 1):
-            total_score = student.score1 + student.score2
-            f.write(f"{idx}\t{student.sno}\t{student.name}\t{student.score1}\t{student.score2}\t{total_score}\n")
+        f.writelines(f"{idx}\t{sno}\t{name}\t{score1}\t{score2}\t{total}\n"
+                     for idx, sno, name, score1, score2, total in ranking_rows(partition))
 
         f.write("\n\n成绩分析\n")
         f.write("=" * 50 + "\n")
-        f.write(f"不及格比例：{fail_ratio:.2f}%\n")
-        f.write(f"及格比例：{pass_ratio:.2f}%\n")
-        f.write(f"良好比例（总分150-169）：{good_ratio:.2f}%\n")
-        f.write(f"优秀比例（总分≥170）：{excellent_ratio:.2f}%\n")
+        f.write(f"不及格比例：{ratios['fail']:.2f}%\n")
+        f.write(f"及格比例：{ratios['pass']:.2f}%\n")
+        f.write(f"良好比例（总分150-169）：{ratios['good']:.2f}%\n")
+        f.write(f"优秀比例（总分≥170）：{ratios['excellent']:.2f}%\n")
 
-    # 生成网页显示内容
-    rows = ""
-    for idx, student in enumerate(sorted_students, 1):
-        total_score = student.score1 + student.score2
-        rows += f"""
+
+def build_ranking_csv(path, partition=NO_PARTITION):
+    with open(path, 'w', encoding='utf-8-sig', newline='', buffering=FILE_BUFFER_SIZE) as f:
+        writer = csv.writer(f)
+        writer.writerow(RANKING_HEADERS)
+        writer.writerows(ranking_rows(partition))
+
+
+def build_ranking_xlsx(path, partition=NO_PARTITION):
+    with open(path, 'wb', buffering=FILE_BUFFER_SIZE) as f:
+        for chunk in stream_xlsx(RANKING_HEADERS, ranking_rows(partition)):
+            f.write(chunk)
+
+
+@app.route('/export_ranking')
+@login_required
+@read_only_route
+def export_ranking():
+    fmt = request.args.get('format', 'txt')
+    if fmt not in RANKING_FORMATS:
+        fmt = 'txt'
+    partition = current_partition()
+    return serve_export(f'ranking_{fmt}', f'student_ranking_{export_version(partition)}.{fmt}', partition)
+
+
+@app.route('/sort_save')
+@login_required
+@read_only_route
+def sort_save():
+    fmt = request.args.get('format', 'txt')
+    if fmt not in RANKING_FORMATS:
+        fmt = 'txt'
+
+    partition = current_partition()
+    ratios = ranking_ratios(partition)
+    # 没有学生时不提交生成文件的任务
+    if not ratios['count']:
+        return f"{html_header('排序与统计')}<p>当前没有学生数据。</p>{html_footer()}"
+    pages = (ratios['count'] + RANKING_PAGE_SIZE - 1) // RANKING_PAGE_SIZE
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+    fail_ratio = ratios['fail']
+    pass_ratio = ratios['pass']
+    good_ratio = ratios['good']
+    excellent_ratio = ratios['excellent']
+
+    # 排名文件交给后台任务生成，页面立即返回
+    version = export_version(partition)
+    kind = f'ranking_{fmt}'
+    download_url = xml_escape(partition_url('/export_ranking', partition, format=fmt))
+    if os.path.exists(artifact_path(kind, version)):
+        file_status = f'成绩排名文件已生成，<a href="{download_url}">点击下载（{fmt}）</a>'
+    else:
+        if not replica_has_version(version, partition):
+            g.read_only = False
+        submit_job(f'{kind}_{version}', lambda: build_artifact(kind, version, partition))
+        file_status = f'成绩排名文件正在后台生成，<a href="{download_url}">生成完成后点击下载（{fmt}）</a>'
+    format_links = ' '.join(
+        f'<a href="{xml_escape(partition_url("/sort_save", partition, format=f))}" '
+        f'class="btn btn-sm {"btn-primary" if f == fmt else "btn-outline-primary"}">{f}</a>'
+        for f in RANKING_FORMATS)
+
+    # 生成网页显示内容：只显示当前页
+    rows = ''.join(f"""
         <tr>
             <td>{idx}</td>
-            <td>{student.sno}</td>
-            <td>{student.name}</td>
-            <td>{student.score1}</td>
-            <td>{student.score2}</td>
+            <td>{xml_escape(sno)}</td>
+            <td>{xml_escape(name)}</td>
+            <td>{score1}</td>
+            <td>{score2}</td>
             <td>{total_score}</td>
         </tr>
-        """
+        """ for idx, sno, name, score1, score2, total_score
+        in ranking_rows(partition, (page - 1) * RANKING_PAGE_SIZE, RANKING_PAGE_SIZE))
+    pager = ''
+    if page > 1:
+        pager += (f'<a href="{xml_escape(partition_url("/sort_save", partition, format=fmt, page=page - 1))}" '
+                  f'class="btn btn-outline-secondary btn-sm">上一页</a> ')
+    if page < pages:
+        pager += (f'<a href="{xml_escape(partition_url("/sort_save", partition, format=fmt, page=page + 1))}" '
+                  f'class="btn btn-outline-primary btn-sm">下一页</a>')
 
     return f"""
     {html_header("排序与统计")}
     <div class="alert alert-success">
-        成绩已保存到文件：{filename}
+        {file_status}
+        <span class="ml-3">文件格式：{format_links}</span>
     </div>
 
     <div class="row mb-4">
@@ -1330,7 +3890,7 @@ def sort_save():
 
     <div class="card">
         <div class="card-body">
-            <h5 class="card-title">学生成绩排名</h5>
+            <h5 class="card-title">学生成绩排名（第 {page}/{pages} 页，共 {ratios['count']} 名学生）</h5>
             <div class="table-responsive">
                 <table class="table table-striped">
                     <thead class="thead-dark">
@@ -1348,56 +3908,451 @@ def sort_save():
                     </tbody>
                 </table>
             </div>
+            {pager}
         </div>
     </div>
     {html_footer()}
     """
 
 # 数据备份
-@app.route('/backup')
-def backup():
-    if not session.get('logged_in'):
-        return redirect(url_for('login'))
+# SQLite 使用在线备份 API 分页复制整个数据库文件；其他后端导出为 gzip 压缩的 JSON Lines 逻辑备份。
+# 每个备份文件旁边有一个 .sha256 校验文件，恢复前先校验。
+BACKUP_SUFFIXES = ('.db', '.jsonl.gz')
+# 增量备份的起点：上次备份时间和未处理的写事务记录（WriteLog）中最早的开始时间，取较早者，再向前多取几秒。
+# 写事务记录随事务提交，备份开始前读取，备份成功后删除读到的这些记录：
+# 在读取之后才提交的事务留到下一次备份。回放是幂等的，重叠不影响结果
+BACKUP_OVERLAP_SECONDS = 5
+BACKUP_WHOLE_TABLES = (User, Course)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_checksum(path):
+    checksum = file_sha256(path)
+    with open(path + '.sha256', 'w') as f:
+        f.write(f"{checksum}  {os.path.basename(path)}\n")
+    return checksum
+
+
+def verify_backup(path):
+    if not os.path.exists(path + '.sha256'):
+        return False
+    with open(path + '.sha256') as f:
+        expected = f.read().split()[0]
+    return file_sha256(path) == expected
+
+
+def json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'无法序列化类型：{type(value).__name__}')
+
+
+def backup_sqlite(engine, path):
+    src = sqlite3.connect(engine.url.database)
+    dst = sqlite3.connect(path)
+    try:
+        # 每次只复制一部分页面，步骤之间释放锁，写入不会被整个备份阻塞
+        src.backup(dst, pages=app.config['BACKUP_PAGES_PER_STEP'], sleep=0.005)
+        counts = {table.name: dst.execute(f'SELECT COUNT(*) FROM "{table.name}"').fetchone()[0]
+                  for table in db.metadata.sorted_tables}
+    finally:
+        dst.close()
+        src.close()
+    return counts
+
+
+def backup_logical(engine, path):
+    counts = {}
+    with engine.connect() as conn, gzip.open(path, 'wt', encoding='utf-8') as f:
+        for table in db.metadata.sorted_tables:
+            f.write(json.dumps({'table': table.name}) + '\n')
+            counts[table.name] = 0
+            result = conn.execution_options(yield_per=1000).execute(table.select())
+            for row in result.mappings():
+                f.write(json.dumps({'row': dict(row)}, ensure_ascii=False, default=json_default) + '\n')
+                counts[table.name] += 1
+    return counts
+
+
+def manifest_path(backup_dir=None):
+    return os.path.join(backup_dir or app.config['BACKUP_DIR'], 'manifest.json')
+
+
+def load_manifest(backup_dir=None):
+    if not os.path.exists(manifest_path(backup_dir)):
+        return []
+    with open(manifest_path(backup_dir), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(entries):
+    tmp_path = manifest_path() + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path())
+
+
+def backup_chain(entries, filename):
+    # 返回恢复某个备份所需的文件：最近的全量备份及其之后的所有增量
+    index = next(i for i, e in enumerate(entries) if e['filename'] == filename)
+    base = max(i for i in range(index + 1) if entries[i]['kind'] == 'full')
+    return entries[base:index + 1]
+
+
+def prune_backups():
+    # 保留最近 BACKUP_RETENTION 份备份，以及它们依赖的全量备份和中间增量
+    entries = load_manifest()
+    retained = entries[-app.config['BACKUP_RETENTION']:]
+    if not retained:
+        return
+    first = backup_chain(entries, retained[0]['filename'])[0]
+    keep_from = entries.index(first)
+    for entry in entries[:keep_from]:
+        for path in (os.path.join(app.config['BACKUP_DIR'], entry['filename']),
+                     os.path.join(app.config['BACKUP_DIR'], entry['filename'] + '.sha256')):
+            if os.path.exists(path):
+                os.remove(path)
+    save_manifest(entries[keep_from:])
+    # 最早的全量备份之前的删除记录已经不再需要
+    StudentChangeLog.query.filter(
+        StudentChangeLog.changed_at < datetime.fromisoformat(first['until'])
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def list_backups():
+    backups = []
+    for entry in reversed(load_manifest()):
+        path = os.path.join(app.config['BACKUP_DIR'], entry['filename'])
+        if os.path.exists(path):
+            backups.append(dict(entry, size=os.path.getsize(path),
+                                created=datetime.fromisoformat(entry['until'])))
+    return backups
+
+
+def pending_write_log(engine):
+    # 返回 (记录ID列表, 最早的事务开始时间)
+    with engine.connect() as conn:
+        rows = conn.execute(db.select(WriteLog.id, WriteLog.started_at)).all()
+    return [row.id for row in rows], min((row.started_at for row in rows), default=None)
+
+
+def clear_write_log(ids):
+    with db.engines[None].begin() as conn:
+        for i in range(0, len(ids), 500):
+            conn.execute(WriteLog.__table__.delete().where(WriteLog.id.in_(ids[i:i + 500])))
+
+
+def backup_incremental(engine, path, since, overlap=BACKUP_OVERLAP_SECONDS):
+    # 只导出 since 之后修改过的学生、删除记录和新记录的成绩历史（历史按学号保存，回放时重新对应学生ID）；
+    # 用户表和课程表没有修改时间，每次整表导出（BACKUP_WHOLE_TABLES）
+    since = datetime.fromisoformat(since) - timedelta(seconds=overlap)
+    student_table = Student.__table__
+    log_table = StudentChangeLog.__table__
+    history_table = ScoreHistory.__table__
+    counts = {'upsert': 0, 'delete': 0, 'history': 0}
+    counts.update({model.__tablename__: 0 for model in BACKUP_WHOLE_TABLES})
+    with engine.connect() as conn, gzip.open(path, 'wt', encoding='utf-8') as f:
+        deleted = conn.execute(
+            db.select(log_table.c.sno).where(log_table.c.changed_at >= since).order_by(log_table.c.id))
+        for (sno,) in deleted:
+            f.write(json.dumps({'delete': sno}, ensure_ascii=False) + '\n')
+            counts['delete'] += 1
+        result = conn.execution_options(yield_per=1000).execute(
+            student_table.select().where(student_table.c.updated_at >= since))
+        for row in result.mappings():
+            row = {k: v for k, v in row.items() if k != 'id'}
+            f.write(json.dumps({'upsert': row}, ensure_ascii=False, default=json_default) + '\n')
+            counts['upsert'] += 1
+        result = conn.execution_options(yield_per=1000).execute(
+            db.select(student_table.c.sno, history_table.c.course, history_table.c.exam_date,
+                      history_table.c.score, history_table.c.recorded_at)
+            .join_from(history_table, student_table, history_table.c.student_id == student_table.c.id)
+            .where(history_table.c.recorded_at >= since))
+        for row in result.mappings():
+            f.write(json.dumps({'history': dict(row)}, ensure_ascii=False, default=json_default) + '\n')
+            counts['history'] += 1
+        for model in BACKUP_WHOLE_TABLES:
+            f.write(json.dumps({'table': model.__tablename__}) + '\n')
+            for row in conn.execute(model.__table__.select()).mappings():
+                f.write(json.dumps({'row': dict(row)}, ensure_ascii=False, default=json_default) + '\n')
+                counts[model.__tablename__] += 1
+    return counts
+
+
+def create_backup(mode='auto'):
+    # mode: full 全量；incremental 增量；auto 没有全量或增量已满 BACKUP_FULL_EVERY 个时做全量
+    os.makedirs(app.config['BACKUP_DIR'], exist_ok=True)
+    # 始终备份主库：从只读路由（/backup）提交的任务中，会话绑定的是只读副本
+    engine = db.engines[None]
+    entries = load_manifest()
+    if mode == 'auto':
+        chain = backup_chain(entries, entries[-1]['filename']) if entries else []
+        mode = 'incremental' if chain and len(chain) <= app.config['BACKUP_FULL_EVERY'] else 'full'
+    if mode == 'incremental' and not entries:
+        mode = 'full'
+
+    version = backup_version()
+    until = datetime.now()
+    logged_ids, logged_since = pending_write_log(engine)
+    timestamp = until.strftime('%Y%m%d_%H%M%S_%f')
+    if mode == 'incremental':
+        filename = f'backup_{timestamp}.delta.jsonl.gz'
+        since = datetime.fromisoformat(entries[-1]['until'])
+        if logged_since is not None:
+            since = min(since, logged_since)
+        backup_func = lambda engine, path: backup_incremental(engine, path, since.isoformat(), BACKUP_OVERLAP_SECONDS)
+    elif engine.dialect.name == 'sqlite' and not is_memory_sqlite(engine.url.render_as_string()):
+        # 内存数据库没有文件可以复制，和其他数据库一样做逻辑备份
+        filename = f'backup_{timestamp}.db'
+        backup_func = backup_sqlite
+    else:
+        filename = f'backup_{timestamp}.jsonl.gz'
+        backup_func = backup_logical
+    path = os.path.join(app.config['BACKUP_DIR'], filename)
+    tmp_path = path + '.tmp'
+    counts = backup_func(engine, tmp_path)
+    os.replace(tmp_path, path)
+    checksum = write_checksum(path)
+    entries.append({'filename': filename, 'kind': mode, 'until': until.isoformat(), 'sha256': checksum,
+                    'version': version, 'counts': counts})
+    save_manifest(entries)
+    clear_write_log(logged_ids)
+    prune_backups()
+    return {'filename': filename, 'path': path, 'kind': mode, 'size': os.path.getsize(path),
+            'sha256': checksum, 'counts': counts, 'created': until}
+
+
+def parse_datetime_columns(table, row):
+    for column in table.columns:
+        if isinstance(column.type, db.DateTime) and row.get(column.name):
+            row[column.name] = datetime.fromisoformat(row[column.name])
+        elif isinstance(column.type, db.Date) and row.get(column.name):
+            row[column.name] = date.fromisoformat(row[column.name])
+    return row
+
+
+def restore_full(path):
+    engine = db.engines[None]
+    db.session.remove()
+    if path.endswith('.db'):
+        if engine.dialect.name != 'sqlite':
+            raise ValueError('SQLite 备份文件只能恢复到 SQLite 数据库')
+        if is_memory_sqlite(engine.url.render_as_string()):
+            raise ValueError('内存数据库不能恢复 SQLite 备份文件，请使用 .jsonl.gz 逻辑备份')
+        engine.dispose()
+        src = sqlite3.connect(path)
+        dst = sqlite3.connect(engine.url.database)
+        try:
+            src.backup(dst, pages=app.config['BACKUP_PAGES_PER_STEP'])
+        finally:
+            dst.close()
+            src.close()
+        return
+    tables = {table.name: table for table in db.metadata.sorted_tables}
+    with engine.begin() as conn, gzip.open(path, 'rt', encoding='utf-8') as f:
+        for table in reversed(db.metadata.sorted_tables):
+            conn.execute(table.delete())
+        table, batch = None, []
+        for line in f:
+            item = json.loads(line)
+            if 'table' in item:
+                if batch:
+                    conn.execute(table.insert(), batch)
+                table, batch = tables[item['table']], []
+                continue
+            batch.append(parse_datetime_columns(table, item['row']))
+            if len(batch) >= 1000:
+                conn.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(table.insert(), batch)
+        reset_sequences(conn)
+
+
+def reset_sequences(conn):
+    # 逻辑恢复按原值写入了主键，PostgreSQL 的自增序列不会跟着变化，需要调到各表当前的最大ID，
+    # 否则恢复后第一次添加会主键冲突
+    if conn.dialect.name != 'postgresql':
+        return
+    preparer = conn.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        column = table.autoincrement_column
+        if column is None:
+            continue
+        max_id = db.select(db.func.max(column)).scalar_subquery()
+        conn.execute(db.select(db.func.setval(
+            db.func.pg_get_serial_sequence(preparer.format_table(table), column.name),
+            db.func.coalesce(max_id, 1), max_id.is_not(None))))
+
+
+def replay_incremental(path):
+    # 先回放删除，再回放插入/更新：删除后又重新添加的学生最终仍然存在
+    update_columns = [c.name for c in Student.__table__.columns if c.name not in ('id', 'sno')]
+    deleted, batch, history = [], [], []
+    models = {model.__tablename__: model for model in BACKUP_WHOLE_TABLES}
+    whole_tables, table = {}, None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            item = json.loads(line)
+            if 'delete' in item:
+                deleted.append(item['delete'])
+            elif 'history' in item:
+                history.append(parse_datetime_columns(ScoreHistory.__table__, item['history']))
+            elif 'table' in item:
+                table = whole_tables.setdefault(item['table'], [])
+            elif 'row' in item:
+                table.append(item['row'])
+            else:
+                batch.append(parse_datetime_columns(Student.__table__, item['upsert']))
+    for i in range(0, len(deleted), 500):
+        snos = deleted[i:i + 500]
+        db.session.execute(ScoreHistory.__table__.delete().where(
+            ScoreHistory.student_id.in_(db.select(Student.id).where(Student.sno.in_(snos)))))
+        db.session.execute(Student.__table__.delete().where(Student.sno.in_(snos)))
+    for i in range(0, len(batch), 1000):
+        upsert_rows(Student, batch[i:i + 1000], ['sno'], update_columns)
+    ids = student_ids({row['sno'] for row in history})
+    rows = [{'student_id': ids[row['sno']], 'course': row['course'], 'exam_date': row['exam_date'],
+             'score': row['score'], 'recorded_at': row['recorded_at']} for row in history if row['sno'] in ids]
+    # 每批 1000 名学生，与学生表的写入批次一致
+    batch = 1000 * len(HISTORY_COURSES)
+    for i in range(0, len(rows), batch):
+        upsert_rows(ScoreHistory, rows[i:i + batch], ['student_id', 'course', 'exam_date'], ['score', 'recorded_at'])
+    # 用户和课程整表替换（较早的增量备份文件中没有这两个表，保持不变）
+    for name, rows in whole_tables.items():
+        model = models[name]
+        db.session.execute(model.__table__.delete().where(model.id.not_in([row['id'] for row in rows])))
+        if rows:
+            upsert_rows(model, rows, ['id'], [c.name for c in model.__table__.columns if c.name != 'id'])
+    db.session.commit()
+    if whole_tables:
+        with db.engines[None].begin() as conn:
+            reset_sequences(conn)
+
+
+def restore_backup(path):
+    # 恢复全量备份，或者恢复“全量 + 之后的所有增量”
+    backup_dir, filename = os.path.split(os.path.abspath(path))
+    entries = load_manifest(backup_dir)
+    if any(e['filename'] == filename for e in entries):
+        chain = backup_chain(entries, filename)
+    else:
+        chain = [{'filename': filename, 'kind': 'full'}]
+    paths = [os.path.join(backup_dir, e['filename']) for e in chain]
+    for p in paths:
+        if not verify_backup(p):
+            raise ValueError(f'备份文件校验失败：{p}')
+    restore_full(paths[0])
+    for p in paths[1:]:
+        replay_incremental(p)
 
-    students = Student.query.all()
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'backup_{timestamp}.txt'
 
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write("学生成绩管理系统 - 数据备份\n")
-        f.write("=" * 50 + "\n")
-        f.write(f"备份时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write("-" * 50 + "\n\n")
+@app.cli.command('backup')
+@click.option('--mode', type=click.Choice(['auto', 'full', 'incremental']), default='auto')
+def backup_command(mode):
+    info = create_backup(mode)
+    print(f"备份完成（{info['kind']}）：{info['path']} sha256={info['sha256']}")
 
-        f.write("学号\t姓名\t课程1\t课程2\t总分\t录入时间\n")
-        f.write("-" * 50 + "\n")
 
-        for student in students:
-            total = student.score1 + student.score2
-            created_time = student.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            f.write(f"{student.sno}\t{student.name}\t{student.score1}\t{student.score2}\t{total}\t{created_time}\n")
+@app.cli.command('restore')
+@click.argument('path')
+def restore_command(path):
+    restore_backup(path)
+    print(f'已从 {path} 恢复数据')
+
+
+@app.cli.command('verify-backup')
+@click.argument('path')
+def verify_backup_command(path):
+    print('校验通过' if verify_backup(path) else '校验失败')
+
+
+@app.route('/backup')
+@role_required('admin')
+@read_only_route
+def backup():
+    mode = request.args.get('mode', 'auto')
+    if mode not in ('auto', 'full', 'incremental'):
+        mode = 'auto'
+
+    # 数据没有变化时不重复备份（除非明确要求全量备份），备份本身在后台线程中进行
+    version = backup_version()
+    entries = load_manifest()
+    if mode != 'full' and entries and entries[-1].get('version') == version:
+        last = entries[-1]
+        info = dict(last, path=os.path.join(app.config['BACKUP_DIR'], last['filename']),
+                    created=datetime.fromisoformat(last['until']))
+    else:
+        job = submit_job(f'backup_{mode}_{version}', lambda: create_backup(mode),
+                         retry=bool(request.args.get('retry')))
+        if job['status'] != 'done':
+            return job_pending_page('数据备份', job)
+        info = job['result']
+    counts = ''.join(f'<li class="list-group-item"><strong>{name}：</strong> {count} 条</li>'
+                     for name, count in info['counts'].items())
+    history = ''.join(f"""
+        <tr>
+            <td>{b['filename']}</td>
+            <td>{'全量' if b['kind'] == 'full' else '增量'}</td>
+            <td>{b['size'] / 1024:.1f} KB</td>
+            <td>{b['created'].strftime('%Y-%m-%d %H:%M:%S')}</td>
+        </tr>
+        """ for b in list_backups())
 
     return f"""
     {html_header("数据备份")}
     <div class="alert alert-success">
-        <i class="fas fa-check-circle"></i> 数据已成功备份到文件：{filename}
+        <i class="fas fa-check-circle"></i> 数据已成功备份到文件：{info['filename']}
     </div>
     <div class="card">
         <div class="card-body">
             <h5 class="card-title">备份信息</h5>
             <ul class="list-group">
                 <li class="list-group-item">
-                    <strong>备份文件名：</strong> {filename}
+                    <strong>备份文件：</strong> {info['path']}
+                </li>
+                <li class="list-group-item">
+                    <strong>备份类型：</strong> {'全量备份' if info['kind'] == 'full' else '增量备份'}
                 </li>
                 <li class="list-group-item">
-                    <strong>备份时间：</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+                    <strong>备份时间：</strong> {info['created'].strftime('%Y-%m-%d %H:%M:%S')}
                 </li>
                 <li class="list-group-item">
-                    <strong>记录总数：</strong> {len(students)}
+                    <strong>SHA-256：</strong> <code>{info['sha256']}</code>
                 </li>
+                {counts}
             </ul>
         </div>
     </div>
+    <div class="card">
+        <div class="card-body">
+            <h5 class="card-title">已有备份（保留最近{app.config['BACKUP_RETENTION']}份）</h5>
+            <table class="table table-sm">
+                <thead>
+                    <tr>
+                        <th>文件名</th>
+                        <th>类型</th>
+                        <th>大小</th>
+                        <th>时间</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {history}
+                </tbody>
+            </table>
+            <a href="/backup?mode=full" class="btn btn-outline-primary btn-sm">立即全量备份</a>
+            <a href="/backup?mode=incremental" class="btn btn-outline-secondary btn-sm">立即增量备份</a>
+            <p class="text-muted mt-2">恢复：<code>flask --app app2 restore &lt;备份文件路径&gt;</code>（增量备份会自动先恢复对应的全量备份）</p>
+        </div>
+    </div>
     {html_footer()}
     """
 
@@ -1438,7 +4393,38 @@ def html_footer():
     </html>
     """
 
+# 应用工厂
+# gunicorn -c gunicorn.conf.py 使用 app2:create_app() 并开启 preload_app：
+# 主进程中完成一次数据库初始化和缓存预热，fork 出的 worker 通过写时复制共享这些内存
+app_initialized = False
+
+
+def warm_caches():
+    # 重量级依赖在模块导入时不加载；预加载的主进程中提前导入，worker 共享这部分内存
+    import pandas  # noqa: F401
+    import reportlab.pdfgen.canvas  # noqa: F401
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        pass
+    try:
+        register_pdf_font()
+    except Exception as e:
+        app.logger.warning(f'PDF字体预加载失败：{e}')
+    index_stats()
+
+
+def create_app():
+    global app_initialized
+    if not app_initialized:
+        with app.app_context():
+            init_db()
+            warm_caches()
+        app_initialized = True
+    return app
+
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()  # 确保数据库表已创建
+        init_db()  # 确保数据库表已创建
     app.run(debug=True)
\ No newline at end of file
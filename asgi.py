@@ -0,0 +1,26 @@
+# ASGI 入口：uvicorn asgi:app 或 gunicorn -c gunicorn.conf.py（APP_SERVER_MODE=asgi）
+# Flask 路由本身是同步的。asgiref 的 WsgiToAsgi 默认把所有请求交给同一个线程（thread_sensitive=True），
+# 一个 worker 同时只能处理一个请求；这里改为在每个 worker 独立的线程池（THREADS 个线程，与 gthread 模式相同）中执行，
+# 慢导出、慢导入只占用其中一个线程，流式响应按块转发。
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app2 import create_app
+
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('THREADS', 4)), thread_name_prefix='asgi')
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.run_wsgi_app.__wrapped__,
+                                 thread_sensitive=False, executor=executor)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+app = ThreadedWsgiToAsgi(create_app())
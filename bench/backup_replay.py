@@ -0,0 +1,88 @@
+# 增量备份回放检查：一个事务在增量备份开始前写入、备份读完之后才提交（慢提交），
+# 之后再做一次增量备份，按“全量 + 所有增量”恢复，核对恢复出的学生表与恢复前完全一致。
+#
+#   python bench/backup_replay.py                 # 一致时退出码为 0
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix='backup-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORK_DIR, 'students.db')}"
+os.environ.pop('DATABASE_READ_URL', None)
+os.environ['BACKUP_DIR'] = os.path.join(WORK_DIR, 'backups')
+os.environ['EXPORT_DIR'] = os.path.join(WORK_DIR, 'exports')
+os.environ['PROFILE_DIR'] = os.path.join(WORK_DIR, 'profiles')
+
+import app2  # noqa: E402
+from bench.roster import generate_students  # noqa: E402
+
+# 去掉固定的重叠窗口，慢提交不需要真的等上几秒
+app2.BACKUP_OVERLAP_SECONDS = 0
+SLOW_COMMIT_SECONDS = 1
+
+
+def student_rows():
+    with app2.app.app_context():
+        return sorted(app2.db.session.execute(app2.db.select(
+            app2.Student.sno, app2.Student.name, app2.Student.score1, app2.Student.score2,
+            app2.Student.school, app2.Student.class_name)).all())
+
+
+def slow_commit(written):
+    # 写入后通知主线程开始备份，过 SLOW_COMMIT_SECONDS 秒再提交
+    with app2.app.app_context():
+        app2.db.session.add(app2.Student(sno='SLOW1', name='慢提交', score1=61, score2=62))
+        app2.db.session.flush()
+        written.set()
+        time.sleep(SLOW_COMMIT_SECONDS)
+        app2.db.session.commit()
+
+
+def main():
+    app2.create_app()
+    with app2.app.app_context():
+        app2.upsert_rows(app2.Student, [{'sno': sno, 'name': name, 'score1': score1, 'score2': score2}
+                                        for sno, name, score1, score2 in generate_students(200)],
+                         ['sno'], ['name', 'score1', 'score2'])
+        app2.db.session.commit()
+        app2.create_backup('full')
+
+    written = threading.Event()
+    writer = threading.Thread(target=slow_commit, args=(written,))
+    writer.start()
+    written.wait()
+    time.sleep(0.1)
+    with app2.app.app_context():
+        # 这次备份看不到还没有提交的 SLOW1
+        app2.create_backup('incremental')
+    writer.join()
+
+    with app2.app.app_context():
+        # 之后的修改不涉及 SLOW1：SLOW1 只能靠写事务记录进入下一次增量
+        app2.db.session.add(app2.Student(sno='LATE1', name='后添加', score1=71, score2=72))
+        app2.db.session.commit()
+        last = app2.create_backup('incremental')
+    expected = student_rows()
+
+    with app2.app.app_context():
+        app2.restore_backup(last['path'])
+    restored = student_rows()
+
+    failures = []
+    if len(restored) != len(expected):
+        failures.append(f'学生人数 {len(restored)}，恢复前 {len(expected)}')
+    missing = sorted(set(expected) - set(restored))
+    failures += [f'恢复后缺少或不一致：{row}' for row in missing[:10]]
+    print(f'恢复前 {len(expected)} 名学生，恢复后 {len(restored)} 名')
+    for line in failures:
+        print('失败：' + line)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# 启动开销基准：测量导入 app2 的耗时和内存
+#
+#   python bench/import_time.py            # 输出总耗时、峰值 RSS 和最慢的模块
+#   python bench/import_time.py --max-ms 800 --max-rss-mb 120   # 超过阈值时返回非零退出码
+#
+# 基于 python -X importtime，每次在新的解释器中运行，取多次运行的中位数。
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHILD = (
+    "import resource, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import app2\n"
+    "elapsed = time.perf_counter() - start\n"
+    "print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stdout)\n"
+)
+
+
+def measure():
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    elapsed, maxrss = proc.stdout.split()
+    modules = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|').split('|')]
+        modules.append((int(cumulative_us), int(self_us), name))
+    # Linux 下 ru_maxrss 单位为KB，macOS 为字节
+    rss_mb = int(maxrss) / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return float(elapsed) * 1000, rss_mb, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='app2 导入耗时基准')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--max-ms', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出，便于记录历史')
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    import_ms = statistics.median(r[0] for r in results)
+    rss_mb = statistics.median(r[1] for r in results)
+    slowest = sorted(results[-1][2], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({'import_ms': round(import_ms, 1), 'rss_mb': round(rss_mb, 1),
+                          'top_modules': [{'module': m, 'cumulative_ms': c / 1000} for c, _, m in slowest]},
+                         ensure_ascii=False))
+    else:
+        print(f'导入 app2：{import_ms:.1f} ms（{args.runs} 次中位数），峰值 RSS：{rss_mb:.1f} MB')
+        print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+        for cumulative, self_us, name in slowest:
+            print(f'{cumulative / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}')
+
+    failed = (args.max_ms is not None and import_ms > args.max_ms) or \
+             (args.max_rss_mb is not None and rss_mb > args.max_rss_mb)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# 简单的 HTTP 压测脚本，用于比较同步（gunicorn gthread）和 ASGI（uvicorn）两种部署方式
+#
+#   python bench/loadtest.py --base http://127.0.0.1:8000 --concurrency 32 --requests 500 /stats /export_csv
+#
+# 先用 admin 账户登录，再并发请求给定路径，输出吞吐量和延迟分位数。
+import argparse
+import http.cookiejar
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def login(base, username, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+    opener.open(base + '/login', data=data).read()
+    return opener
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run(opener, url, total, concurrency):
+    def fetch(_):
+        start = time.perf_counter()
+        try:
+            with opener.open(url) as resp:
+                size = len(resp.read())
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            size, status = 0, e.code
+        except OSError:
+            size, status = 0, 599
+        return time.perf_counter() - start, status, size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(fetch, range(total)))
+    elapsed = time.perf_counter() - started
+    latencies = [r[0] * 1000 for r in results]
+    errors = sum(1 for r in results if r[1] >= 400)
+    return {
+        'rps': total / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'mean': statistics.mean(latencies),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='学生成绩管理系统压测')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--base', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    args = parser.parse_args()
+
+    opener = login(args.base, args.username, args.password)
+    print(f"{'path':<20}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for path in args.paths:
+        r = run(opener, args.base + path, args.requests, args.concurrency)
+        print(f"{path:<20}{r['rps']:>10.1f}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['p99']:>10.1f}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
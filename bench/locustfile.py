@@ -0,0 +1,57 @@
+# Locust 压测场景（可选，需要 pip install locust）：
+#
+#   locust -f bench/locustfile.py --host http://127.0.0.1:8000 --users 50 --spawn-rate 10
+#
+# 先用 bench/roster.py 准备数据。权重大致对应日常使用：浏览为主，偶尔导出和导入。
+import os
+import sys
+
+from locust import HttpUser, between, task
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMPORT_FILE = os.environ.get('BENCH_IMPORT_FILE')
+
+
+class Teacher(HttpUser):
+    wait_time = between(0.5, 2)
+
+    def on_start(self):
+        self.client.post('/login', data={'username': os.environ.get('BENCH_USERNAME', 'admin'),
+                                         'password': os.environ.get('BENCH_PASSWORD', 'admin123')})
+
+    @task(10)
+    def index(self):
+        self.client.get('/')
+
+    @task(5)
+    def list_students(self):
+        self.client.get('/list')
+
+    @task(5)
+    def stats(self):
+        self.client.get('/stats')
+
+    @task(2)
+    def sort_save(self):
+        self.client.get('/sort_save')
+
+    @task(2)
+    def export_csv(self):
+        self.client.get('/export_csv')
+
+    @task(1)
+    def export_pdf(self):
+        self.client.get('/export_pdf')
+
+    @task(1)
+    def backup(self):
+        self.client.get('/backup')
+
+    @task(1)
+    def import_students(self):
+        # BENCH_IMPORT_FILE 指向 roster.py --csv 生成的文件
+        if not IMPORT_FILE:
+            return
+        with open(IMPORT_FILE, 'rb') as f:
+            self.client.post('/import_export', files={'file': ('import.csv', f, 'text/csv')})
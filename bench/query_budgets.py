@@ -0,0 +1,144 @@
+# 查询次数预算检查：在两种数据量下逐个请求所有路由，核对每次请求的 SQL 条数不超过 app2.QUERY_BUDGETS，
+# 且不随学生数量增长（逐行查询会让第二轮的条数变大）。
+# 每个数据量跑两遍：cold 在每个请求前清空用户缓存，包含加载用户的那条查询；warm 使用已缓存的用户。
+# 修改类请求在 cold 这一遍真正改动数据，预算必须能容纳 cold 的条数。
+# 条数在请求外层统计，包括流式导出在发送响应体时执行的查询（这些响应没有 X-Query-Count 头）。
+#
+#   python bench/query_budgets.py                 # 全部通过时退出码为 0
+#   python bench/query_budgets.py --sizes 100,5000
+import argparse
+import io
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix='budget-')
+# 已设置 DATABASE_URL（例如本地临时的 PostgreSQL）时在该数据库上检查，否则使用临时 SQLite 文件
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(WORK_DIR, 'students.db')}")
+os.environ['EXPORT_DIR'] = os.path.join(WORK_DIR, 'exports')
+os.environ['BACKUP_DIR'] = os.path.join(WORK_DIR, 'backups')
+os.environ['PROFILE_DIR'] = os.path.join(WORK_DIR, 'profiles')
+os.environ['QUERY_BUDGET_WARN'] = '1'
+# 服务器端会话的读写在请求钩子之外执行，不属于路由预算；用 Cookie 会话，外层计数只包含路由本身的查询
+os.environ['SESSION_BACKEND'] = 'cookie'
+
+import app2  # noqa: E402
+from bench.roster import generate_students, make_partition  # noqa: E402
+
+
+def import_file(count, start):
+    lines = ['学号,姓名,课程1成绩,课程2成绩']
+    lines += [f'{sno},{name},{score1},{score2}' for sno, name, score1, score2 in generate_students(count, 7, start=start)]
+    return io.BytesIO('\n'.join(lines).encode('utf-8-sig'))
+
+
+def bad_import_file(count):
+    # 每行成绩都超出范围，用于生成错误报告
+    lines = ['学号,姓名,课程1成绩,课程2成绩'] + [f'X{i},错误,120,50' for i in range(count)]
+    return io.BytesIO('\n'.join(lines).encode('utf-8-sig'))
+
+
+def requests_for(size, report_id):
+    # (规则, 方法, 路径, 表单数据)
+    sno = '2024' + f'{size - 1:07d}'
+    return [
+        ('/', 'GET', '/', None),
+        ('/add', 'GET', '/add', None),
+        ('/add', 'POST', '/add', {'sno': f'B{size}', 'name': '预算', 'score1': '80', 'score2': '90'}),
+        ('/list', 'GET', '/list', None),
+        ('/list/<sort_by>', 'GET', '/list/total?direction=desc', None),
+        ('/edit/<sno>', 'GET', f'/edit/{sno}', None),
+        ('/edit/<sno>', 'POST', f'/edit/{sno}', {'name': '预算', 'score1': '70', 'score2': '75', 'school': '学校2', 'class_name': '3班'}),
+        ('/delete/<sno>', 'GET', f'/delete/B{size}', None),
+        ('/audit', 'GET', '/audit', None),
+        ('/stats', 'GET', '/stats', None),
+        ('/stats', 'GET', '/stats?school=学校1&class=1班', None),
+        ('/stats/chart', 'GET', '/stats/chart', None),
+        ('/stats/chart', 'GET', '/stats/chart?school=学校1&class=1班', None),
+        ('/stats/students', 'GET', '/stats/students?course=1&grade=good', None),
+        ('/stats/students', 'GET', '/stats/students?course=2&grade=fail&school=学校1&class=1班&after=2024', None),
+        ('/list', 'GET', '/list?school=学校1&class=1班', None),
+        ('/trend', 'GET', '/trend?school=学校1&class=1班', None),
+        ('/trend', 'GET', '/trend?sno=20240000000&course=2&window=5', None),
+        ('/import_export', 'GET', '/import_export', None),
+        ('/import_export', 'POST', '/import_export', lambda: {'file': (import_file(size // 2, size // 2), 'a.csv')}),
+        ('/import_report/<report_id>', 'GET', f'/import_report/{report_id}', None),
+        ('/import_report/<report_id>/download', 'GET', f'/import_report/{report_id}/download', None),
+        ('/export_csv', 'GET', '/export_csv', None),
+        ('/export_pdf', 'GET', '/export_pdf', None),
+        ('/export_parquet', 'GET', '/export_parquet', None),
+        ('/export_arrow', 'GET', '/export_arrow', None),
+        ('/export_xlsx', 'GET', '/export_xlsx', None),
+        ('/export_ranking', 'GET', '/export_ranking?format=csv', None),
+        ('/sort_save', 'GET', '/sort_save', None),
+        ('/backup', 'GET', '/backup', None),
+        ('/metrics', 'GET', '/metrics', None),
+        ('/logout', 'GET', '/logout', None),
+        ('/login', 'GET', '/login', None),
+        ('/login', 'POST', '/login', {'username': 'admin', 'password': 'admin123'}),
+    ]
+
+
+def load(size):
+    with app2.app.app_context():
+        rows = [{'sno': sno, 'name': name, 'score1': score1, 'score2': score2,
+                 'school': school, 'class_name': class_name}
+                for index, (sno, name, score1, score2) in enumerate(generate_students(size))
+                for school, class_name in [make_partition(index)]]
+        for i in range(0, len(rows), 1000):
+            app2.upsert_rows(app2.Student, rows[i:i + 1000], ['sno'],
+                             ['name', 'score1', 'score2', 'school', 'class_name'])
+        app2.db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查每个路由的查询次数预算')
+    parser.add_argument('--sizes', default='50,2000')
+    args = parser.parse_args()
+
+    app2.create_app()
+    sizes = [int(s) for s in args.sizes.split(',')]
+    counts = {}
+    for size in sizes:
+        load(size)
+        client = app2.app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        response = client.post('/import_export', data={'file': (bad_import_file(size), 'bad.csv')})
+        report_id = response.location.rsplit('/', 1)[-1]
+        for cache in ('cold', 'warm'):
+            for rule, method, path, data in requests_for(size, report_id):
+                if callable(data):
+                    data = data()
+                if cache == 'cold':
+                    app2.user_cache.clear()
+                # 在请求外面再套一个预算计数：流式导出在读取响应体时才执行的查询也算在内
+                with app2.query_budget(None) as budget:
+                    response = client.open(path, method=method, data=data)
+                    response.get_data()
+                    response.close()
+                # 同一规则的不同参数（例如只看一个班级）分开统计
+                label = rule + (path[path.index('?'):] if '?' in path else '')
+                counts.setdefault((rule, label, method, cache), []).append(budget.count)
+
+    rules = {r.rule for r in app2.app.url_map.iter_rules() if r.endpoint != 'static'}
+    failures = [f'{rule}：没有设置预算' for rule in sorted(rules - set(app2.QUERY_BUDGETS))]
+    failures += [f'{rule}：没有被检查' for rule in sorted(rules - {key[0] for key in counts})]
+    print(f"{'route':<40}{'method':<8}{'cache':<6}{'budget':>7}  " + ''.join(f'{size:>8}' for size in sizes))
+    for (rule, label, method, cache), values in counts.items():
+        budget = app2.QUERY_BUDGETS.get(rule)
+        print(f'{label:<40}{method:<8}{cache:<6}{budget:>7}  ' + ''.join(f'{v:>8}' for v in values))
+        label = f'{label}（{cache}）'
+        if budget is not None and max(values) > budget:
+            failures.append(f'{method} {label}：{max(values)} 条，超出预算 {budget} 条')
+        if values[-1] > values[0]:
+            failures.append(f'{method} {label}：查询次数随数据量增长 {values}')
+    for line in failures:
+        print('失败：' + line)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
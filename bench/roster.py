@@ -0,0 +1,120 @@
+# 合成学生名单：生成指定数量的学生（中文姓名、可选成绩分布），批量写入数据库或导出为导入用的 CSV
+#
+#   python bench/roster.py --students 100000                          # 清空并写入 app2 配置的数据库
+#   DATABASE_URL=sqlite:////tmp/bench.db python bench/roster.py --students 1000000 --distribution bimodal
+#   python bench/roster.py --students 5000 --csv import.csv --duplicate-ratio 0.2   # 生成导入文件
+#
+# 同一个 --seed 生成的数据完全相同，便于前后对比。学生按学号顺序分班：每班 --class-size 人，
+# 每个学校 --classes-per-school 个班，班级人数固定，学生越多学校越多。
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤'
+GIVEN_CHARS = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超秀兰霞平刚桂英华玉萍红娥玲芬燕彬鹏辉宇浩然欣怡子轩梓涵一诺雨泽思远嘉豪佳琪晨曦俊杰'
+DISTRIBUTIONS = ('normal', 'uniform', 'bimodal')
+LOAD_BATCH_SIZE = 10000
+CLASS_SIZE = 40
+CLASSES_PER_SCHOOL = 30
+
+
+def make_sno(index):
+    return f'2024{index:07d}'
+
+
+def make_partition(index, class_size=CLASS_SIZE, classes_per_school=CLASSES_PER_SCHOOL):
+    class_index = index // class_size
+    return f'学校{class_index // classes_per_school + 1}', f'{class_index % classes_per_school + 1}班'
+
+
+def make_score(rng, distribution):
+    if distribution == 'uniform':
+        score = rng.uniform(0, 100)
+    elif distribution == 'bimodal':
+        score = rng.gauss(55, 10) if rng.random() < 0.3 else rng.gauss(82, 8)
+    else:
+        score = rng.gauss(75, 12)
+    return round(min(100.0, max(0.0, score)) * 2) / 2
+
+
+def generate_students(count, seed=0, distribution='normal', start=0):
+    rng = random.Random(seed)
+    for i in range(start, start + count):
+        name = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_CHARS) for _ in range(rng.choice((1, 2, 2))))
+        yield make_sno(i), name, make_score(rng, distribution), make_score(rng, distribution)
+
+
+def write_import_file(path, count, existing=0, duplicate_ratio=0.1, seed=1, distribution='normal'):
+    # duplicate_ratio 的行复用已有学号（测试更新），其中一部分在文件内也重复（以最后一行为准）
+    rng = random.Random(seed)
+    students = list(generate_students(count, seed, distribution, start=existing))
+    for i in range(len(students)):
+        if rng.random() < duplicate_ratio:
+            if existing and rng.random() < 0.7:
+                sno = make_sno(rng.randrange(existing))
+            else:
+                sno = students[rng.randrange(max(1, i))][0]
+            students[i] = (sno,) + students[i][1:]
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['学号', '姓名', '课程1成绩', '课程2成绩'])
+        writer.writerows(students)
+    return len(students)
+
+
+def load_students(count, seed=0, distribution='normal', class_size=CLASS_SIZE, classes_per_school=CLASSES_PER_SCHOOL):
+    # 清空学生表后批量插入；直接使用 Core 的 executemany，不经过 ORM
+    import app2
+    app2.create_app()
+    with app2.app.app_context():
+        engine = app2.db.engines[None]
+        table = app2.Student.__table__
+        now = datetime.now()
+        batch = []
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+            conn.execute(app2.StudentChangeLog.__table__.delete())
+            conn.execute(app2.ScoreHistory.__table__.delete())
+            for index, (sno, name, score1, score2) in enumerate(generate_students(count, seed, distribution)):
+                school, class_name = make_partition(index, class_size, classes_per_school)
+                batch.append({'sno': sno, 'name': name, 'score1': score1, 'score2': score2,
+                              'school': school, 'class_name': class_name,
+                              'created_at': now, 'updated_at': now})
+                if len(batch) >= LOAD_BATCH_SIZE:
+                    conn.execute(table.insert(), batch)
+                    batch = []
+            if batch:
+                conn.execute(table.insert(), batch)
+        return engine.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成学生数据')
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='normal')
+    parser.add_argument('--csv', help='生成导入文件而不是写入数据库')
+    parser.add_argument('--existing', type=int, default=0, help='导入文件中可复用的已有学号数量')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1)
+    parser.add_argument('--class-size', type=int, default=CLASS_SIZE)
+    parser.add_argument('--classes-per-school', type=int, default=CLASSES_PER_SCHOOL)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.csv:
+        rows = write_import_file(args.csv, args.students, args.existing, args.duplicate_ratio,
+                                 args.seed, args.distribution)
+        print(f'已生成 {args.csv}：{rows} 行，耗时 {time.perf_counter() - start:.1f} 秒')
+    else:
+        url = load_students(args.students, args.seed, args.distribution, args.class_size, args.classes_per_school)
+        print(f'已写入 {url}：{args.students} 名学生，耗时 {time.perf_counter() - start:.1f} 秒')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# 生产环境启动配置：gunicorn -c gunicorn.conf.py
+# APP_SERVER_MODE=sync（默认）使用 gthread 同步 worker；APP_SERVER_MODE=asgi 使用 uvicorn worker 运行 asgi:app
+import gc
+import multiprocessing
+import os
+
+mode = os.environ.get('APP_SERVER_MODE', 'sync')
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+timeout = int(os.environ.get('TIMEOUT', 120))
+keepalive = 5
+
+# 在主进程中加载应用：数据库初始化只执行一次，预热的缓存通过写时复制在 worker 间共享
+preload_app = True
+
+if mode == 'asgi':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    # 同步路由在每个 worker 的线程池（THREADS 个线程，见 asgi.py）中执行，worker 和线程数与 gthread 模式相同
+    workers = int(os.environ.get('WEB_CONCURRENCY', cpu_count * 2 + 1))
+else:
+    wsgi_app = 'app2:create_app()'
+    worker_class = 'gthread'
+    workers = int(os.environ.get('WEB_CONCURRENCY', cpu_count * 2 + 1))
+    threads = int(os.environ.get('THREADS', 4))
+
+
+def when_ready(server):
+    # 预加载产生的对象不再被垃圾回收扫描，避免 worker 中的 GC 触碰这些页面导致写时复制失效
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # 主进程中建立的数据库连接不能被子进程共用
+    from app2 import app, db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)